@@ -1,17 +1,33 @@
 import streamlit as st
 import pandas as pd
-import re
-import asyncio
-import nest_asyncio
+import json
 import os
+import queue
+import shutil
 import tempfile
-import zipfile
-import io
-from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError
+from scraper import (
+    DEFAULT_CACHE_TTL,
+    DEFAULT_CHANNEL_RATE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_GLOBAL_RATE,
+    DEFAULT_MAX_FLOOD_WAIT,
+    ClientPool,
+    EntityCache,
+    FetchScheduler,
+    Job,
+    MessageCache,
+    download_all_media,
+    export_messages,
+    load_messages,
+    read_raw_record,
+    split_links,
+)
 
-# Apply nest_asyncio to allow nested event loops.
-nest_asyncio.apply()
+# Rows shown per page of the results table.
+PAGE_SIZE = 500
+# How often (in rows) the live row counter is refreshed while fetching.
+ROW_COUNT_INTERVAL = 100
 
 # -------------------------------------------
 # Translation Dictionary
@@ -29,7 +45,7 @@ MESSAGES = {
             "2. Enter your API credentials and phone number below, then click **Sign In**.\n\n"
             "3. If required, enter the authentication code that Telegram sends you. If two‐factor authentication is enabled, you will then be prompted for your password.\n\n"
             "4. Once signed in, enter one or more Telegram post or chat links (e.g. `https://t.me/channel/12345` or `https://t.me/c/1567469683/2394725`) to retrieve message data. The data will be displayed in a table and as raw message objects.\n\n"
-            "   **Note on Raw Message Objects:** These contain the full JSON data from Telegram, which is critical in a judicial setting as it preserves all metadata, timestamps, and any hidden attributes of the messages. This raw data can be used as evidence to validate the authenticity and context of the posts.\n\n"
+            "   **Note on Raw Message Objects:** These contain the full JSON data from Telegram, which is critical in a judicial setting as it preserves all metadata, timestamps, and any hidden attributes of the messages. This raw data can be used as evidence to validate the authenticity and context of the posts. Each message is exported as canonical JSON together with its SHA-256 hash, so the evidence file can be verified byte for byte.\n\n"
             "5. If any posts contain media (including files in galleries), a button will appear allowing you to download all media in a ZIP archive.\n\n"
             "If you encounter a **'database is locked'** error, click **Reset Session** to disconnect any previous session."
         ),
@@ -39,7 +55,7 @@ MESSAGES = {
             "2. Введіть свої облікові дані API та номер телефону нижче, а потім натисніть **Увійти**.\n\n"
             "3. Якщо потрібно, введіть код аутентифікації, який надсилає Telegram. Якщо увімкнено двофакторну аутентифікацію, ви будете запитані про ваш пароль.\n\n"
             "4. Після входу введіть одне або декілька посилань публікацій або чатів Telegram (наприклад, `https://t.me/channel/12345` або `https://t.me/c/1567469683/2394725`), щоб отримати дані повідомлень. Дані будуть відображені у вигляді таблиці та як сирі об'єкти повідомлень.\n\n"
-            "   **Примітка про сирі об'єкти повідомлень:** Вони містять повні JSON-дані з Telegram, що є критично важливим у судовому процесі, оскільки зберігають всю метадані, часові мітки та інші приховані атрибути повідомлень. Ці сирі дані можна використати як докази для підтвердження автентичності та контексту публікацій.\n\n"
+            "   **Примітка про сирі об'єкти повідомлень:** Вони містять повні JSON-дані з Telegram, що є критично важливим у судовому процесі, оскільки зберігають всю метадані, часові мітки та інші приховані атрибути повідомлень. Ці сирі дані можна використати як докази для підтвердження автентичності та контексту публікацій. Кожне повідомлення експортується як канонічний JSON разом з його хешем SHA-256, тож файл доказів можна перевірити побайтово.\n\n"
             "5. Якщо будь-яка публікація містить медіа (у тому числі файли з галереї), з'явиться кнопка, яка дозволить завантажити всі медіа у вигляді ZIP-архіву.\n\n"
             "Якщо ви отримаєте помилку **'database is locked'**, натисніть **Скинути сесію**, щоб розірвати попередню сесію."
         )
@@ -85,23 +101,105 @@ MESSAGES = {
     "retrieved_data": {"en": "Retrieved Telegram Data", "uk": "Отримані дані Telegram"},
     "download_csv": {"en": "Download data as CSV", "uk": "Завантажити дані у форматі CSV"},
     "raw_message_objects": {"en": "Raw Message Objects", "uk": "Сирі об'єкти повідомлень"},
-    "message_object": {"en": "Message Object", "uk": "Об'єкт повідомлення"},
     "no_links_error": {"en": "Please enter some Telegram post links.", "uk": "Будь ласка, введіть посилання публікацій Telegram."},
     "no_message_data_warning": {
         "en": "No message data was retrieved. Please check your links or try again.",
         "uk": "Дані повідомлень не отримано. Будь ласка, перевірте посилання або спробуйте знову."
     },
-    "link_not_recognised": {"en": "Link not recognised:", "uk": "Посилання не розпізнано:"},
-    "processing_message": {
-        "en": "Processing message from **{channel}** with ID **{msg_id}**",
-        "uk": "Обробка повідомлення з **{channel}** з ID **{msg_id}**"
+    "link_not_recognised": {"en": "Link not recognised: {link}", "uk": "Посилання не розпізнано: {link}"},
+    "fetch_error": {
+        "en": "An error occurred while fetching {link}: {error}",
+        "uk": "Сталася помилка при отриманні {link}: {error}"
+    },
+    "processing_batch": {
+        "en": "Fetching **{count}** message(s) from **{channel}**",
+        "uk": "Отримання **{count}** повідомлень з **{channel}**"
     },
     "no_message_found": {
         "en": "No message found for link: {link}",
         "uk": "Не знайдено повідомлення для посилання: {link}"
     },
+    "fetch_settings": {"en": "Fetch settings", "uk": "Налаштування отримання"},
+    "concurrency": {"en": "Requests in flight", "uk": "Одночасних запитів"},
+    "global_rate": {"en": "Global requests per second", "uk": "Запитів на секунду (загалом)"},
+    "channel_rate": {"en": "Requests per second per channel", "uk": "Запитів на секунду на канал"},
+    "max_flood_wait": {
+        "en": "Longest flood wait to sit out (seconds); links hit by longer waits fail",
+        "uk": "Найдовше очікування flood wait (секунд); посилання з довшим очікуванням завершуються помилкою"
+    },
+    "fetch_stats": {
+        "en": "Fetched {messages} message(s) in {requests} request(s) over {elapsed:.1f}s ({rate:.1f} messages/s). Flood waits: {flood_waits}, {flood_seconds:.1f}s spent waiting.",
+        "uk": "Отримано {messages} повідомлень за {requests} запитів за {elapsed:.1f} с ({rate:.1f} повідомлень/с). Flood wait: {flood_waits}, очікування {flood_seconds:.1f} с."
+    },
+    "expand_albums": {
+        "en": "Include all items of albums (galleries) the links point into",
+        "uk": "Включати всі елементи альбомів (галерей), на які вказують посилання"
+    },
+    "cache_ttl": {
+        "en": "Refresh cached messages older than (minutes, 0 = never)",
+        "uk": "Оновлювати кешовані повідомлення, старші за (хвилин, 0 = ніколи)"
+    },
+    "force_refresh": {"en": "Force refresh (ignore the message cache)", "uk": "Примусово оновити (ігнорувати кеш повідомлень)"},
+    "cache_stats": {
+        "en": "Message cache: {hits} hit(s), {misses} miss(es).",
+        "uk": "Кеш повідомлень: {hits} влучань, {misses} промахів."
+    },
+    "unresolved_channel": {
+        "en": "Could not resolve **{channel}** ({count} link(s) skipped): {error}",
+        "uk": "Не вдалося визначити **{channel}** (пропущено посилань: {count}): {error}"
+    },
+    "rows_retrieved": {"en": "Retrieved {count} message(s)...", "uk": "Отримано {count} повідомлень..."},
+    "page": {"en": "Page (of {pages}, {rows} rows)", "uk": "Сторінка (з {pages}, рядків: {rows})"},
+    "inspect_row": {
+        "en": "Row number to inspect (0 = none)",
+        "uk": "Номер рядка для перегляду (0 = жоден)"
+    },
+    "download_raw_json": {
+        "en": "Download raw messages as JSONL",
+        "uk": "Завантажити сирі повідомлення у форматі JSONL"
+    },
+    "message_hash": {
+        "en": "{link} — SHA-256 of the canonical JSON: `{sha256}`",
+        "uk": "{link} — SHA-256 канонічного JSON: `{sha256}`"
+    },
+    "job_mode": {
+        "en": "Run as a resumable job (progress is checkpointed to disk)",
+        "uk": "Запустити як відновлюване завдання (прогрес зберігається на диску)"
+    },
+    "resume_job_id": {"en": "Job ID to resume", "uk": "ID завдання для відновлення"},
+    "resume_job": {"en": "Resume Job", "uk": "Відновити завдання"},
+    "job_not_found": {"en": "No job found with ID {job_id}.", "uk": "Завдання з ID {job_id} не знайдено."},
+    "job_started": {
+        "en": "Job **{job_id}**: use this ID to resume it if the run is interrupted.",
+        "uk": "Завдання **{job_id}**: використайте цей ID, щоб відновити його, якщо запуск перерветься."
+    },
+    "job_summary": {
+        "en": "Job {job_id}: {completed} completed, {failed} failed, {pending} pending. Resume it to retry the rest.",
+        "uk": "Завдання {job_id}: виконано {completed}, невдалих {failed}, в очікуванні {pending}. Відновіть його, щоб повторити решту."
+    },
     "download_all_media": {"en": "Download All Media", "uk": "Завантажити всі медіа"},
-    "downloading_media_spinner": {"en": "Downloading media...", "uk": "Завантаження медіа..."}
+    "downloading_media_spinner": {"en": "Downloading media...", "uk": "Завантаження медіа..."},
+    "media_stats": {
+        "en": "Packed {files} file(s), {megabytes:.1f} MB in {elapsed:.1f}s ({rate:.2f} MB/s): {downloaded} downloaded, {reused} reused from the media store, {errors} failed.",
+        "uk": "Упаковано {files} файлів, {megabytes:.1f} МБ за {elapsed:.1f} с ({rate:.2f} МБ/с): завантажено {downloaded}, взято зі сховища медіа {reused}, з помилкою {errors}."
+    },
+    "peak_memory": {"en": "Peak memory: {peak_megabytes:.1f} MB", "uk": "Пікове використання пам'яті: {peak_megabytes:.1f} МБ"},
+    "media_not_loaded": {
+        "en": "Could not load the message with media for {link}: {error}",
+        "uk": "Не вдалося завантажити повідомлення з медіа для {link}: {error}"
+    },
+    "media_error": {
+        "en": "Could not download media for {link}: {error}",
+        "uk": "Не вдалося завантажити медіа для {link}: {error}"
+    },
+    "use_all_accounts": {
+        "en": "Spread requests across all signed-in accounts ({count} available)",
+        "uk": "Розподіляти запити між усіма авторизованими обліковими записами (доступно: {count})"
+    },
+    "pool_stats": {
+        "en": "Connection pool: {clients} active client(s), {pending} running operation(s), {queued} queued request(s).",
+        "uk": "Пул з'єднань: активних клієнтів {clients}, операцій виконується {pending}, запитів у черзі {queued}."
+    }
 }
 
 # -------------------------------------------
@@ -116,132 +214,67 @@ lang = "en" if language == "English" else "uk"
 st.markdown(MESSAGES["overview"][lang])
 
 # -------------------------------------------
-# Asynchronous functions for Telegram operations
+# Progress reporting from the scraping pipeline
 # -------------------------------------------
-async def async_get_telegram_client(api_id, api_hash, phone):
-    # Use a session file name that includes the phone number.
-    client = TelegramClient("session_" + phone, api_id, api_hash)
-    await client.connect()  # Connect without interactive prompts.
-    return client
+# Telegram work runs on the client pool's background thread, where Streamlit
+# widgets cannot be updated, so UI updates are queued and drawn by this
+# script while it waits for the work to finish.
+PROGRESS_WIDGETS = {"info": st.write, "warning": st.warning, "error": st.error}
+ui_updates = queue.Queue()
+
+def draw_ui_updates():
+    while True:
+        try:
+            update = ui_updates.get_nowait()
+        except queue.Empty:
+            return
+        update()
+
+def report_progress(level, event, **details):
+    text = MESSAGES[event][lang].format(**details)
+    ui_updates.put(lambda: PROGRESS_WIDGETS[level](text))
 
 # -------------------------------------------
-# Helper function to process links (handles both username and /c/ chat links)
+# Shared Telegram client pool
 # -------------------------------------------
-def process_link(link):
-    # If the link is in the /c/ format (for chats)
-    pattern_chat = r"(?:https?://)?t\.me/c/(\d+)/(\d+)"
-    match_chat = re.search(pattern_chat, link)
-    if match_chat:
-        # For t.me/c/ links, the channel identifier is calculated as follows:
-        # Actual channel id = -(int(part) + 1000000000000)
-        channel_id = -(int(match_chat.group(1)) + 1000000000000)
-        message_id = int(match_chat.group(2))
-        return channel_id, message_id
-    # Otherwise, try the standard pattern with username.
-    pattern_username = r"(?:https?://)?t\.me/([^/]+)/(\d+)"
-    match_username = re.search(pattern_username, link)
-    if match_username:
-        username = match_username.group(1)
-        message_id = int(match_username.group(2))
-        return username, message_id
-    return None, None
+# One pool per server process: every browser session reuses the same
+# connected client for a phone number, all running on one event loop.
+@st.cache_resource
+def get_client_pool():
+    return ClientPool()
 
-async def get_message_data(client, channel_identifier, message_id):
-    try:
-        message = await client.get_messages(channel_identifier, ids=message_id)
-    except Exception as e:
-        return None, str(e)
-    return message, None
+pool = get_client_pool()
 
-async def process_messages(client, links):
-    results = []
-    raw_messages = []
-    for link in links:
-        channel_identifier, message_id = process_link(link)
-        if channel_identifier is None:
-            st.warning(f"{MESSAGES['link_not_recognised'][lang]} {link}")
-            continue
-        display_channel = channel_identifier if isinstance(channel_identifier, str) else f"Chat {channel_identifier}"
-        st.write(MESSAGES["processing_message"][lang].format(channel=display_channel, msg_id=message_id))
-        message, error = await get_message_data(client, channel_identifier, message_id)
-        if error:
-            st.error(MESSAGES["sign_in_error_prefix"][lang] + f"{link}: {error}")
-            continue
-        if message:
-            raw_messages.append((link, message))
-            reactions_str = ""
-            if message.reactions and hasattr(message.reactions, 'results') and message.reactions.results:
-                reactions_list = [
-                    f"{reaction.reaction.emoticon}: {reaction.count}"
-                    for reaction in message.reactions.results
-                    if reaction.reaction and hasattr(reaction.reaction, 'emoticon')
-                ]
-                reactions_str = ", ".join(reactions_list)
-            entities_str = ""
-            if message.entities:
-                entities_str = ", ".join({type(entity).__name__ for entity in message.entities})
-            data = {
-                "Channel": display_channel,
-                "Message ID": message.id,
-                "Date": message.date.strftime("%Y-%m-%d %H:%M:%S") if message.date else None,
-                "Edit Date": message.edit_date.strftime("%Y-%m-%d %H:%M:%S") if message.edit_date else None,
-                "Text": message.message,
-                "Media Present": "Yes" if message.media else "No",
-                "Media Type": type(message.media).__name__ if message.media else None,
-                "Views": message.views,
-                "Forwards": message.forwards,
-                "Reactions": reactions_str,
-                "Entities": entities_str,
-                "Pinned": message.pinned,
-                "Silent": message.silent,
-                "Post": message.post,
-                "Forwarded": "Yes" if message.fwd_from else "No",
-                "Via Bot": message.via_bot_id,
-                "Grouped ID": message.grouped_id,
-            }
-            results.append(data)
-        else:
-            st.warning(MESSAGES["no_message_found"][lang].format(link=link))
-    return results, raw_messages
+def run_in_pool(coroutine):
+    return pool.run(coroutine, on_wait=draw_ui_updates)
 
-# -------------------------------------------
-# Async function to download all media from raw messages.
-# -------------------------------------------
-async def download_all_media(client, raw_messages):
-    media_files = []
-    # Create a temporary directory to download media
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        for link, message in raw_messages:
-            if message.media:
-                # Download the media file into the temporary directory.
-                file_path = await client.download_media(message.media, file=tmpdirname)
-                if file_path:
-                    media_files.append(file_path)
-        # Create a zip archive of all downloaded media
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zipf:
-            for file_path in media_files:
-                zipf.write(file_path, arcname=os.path.basename(file_path))
-        zip_buffer.seek(0)
-        return zip_buffer.read()
+def discard_run():
+    # Forgets the last run and removes its temporary directory of outputs.
+    run = st.session_state.pop("run", None)
+    if run:
+        shutil.rmtree(run["dir"], ignore_errors=True)
+
+def deferred_file(path):
+    # download_button reads file-like data into memory on every rerun; a
+    # callable is only called, and the file read, when the button is clicked.
+    return lambda: open(path, "rb")
 
 # -------------------------------------------
 # Session Management and Reset
 # -------------------------------------------
-if "loop" not in st.session_state:
-    st.session_state.loop = asyncio.new_event_loop()
-
 if st.button(MESSAGES["reset_session"][lang]):
+    # Only the account signed in from this session is disconnected and has
+    # its session file removed; other accounts in the pool are left alone.
     if "client" in st.session_state:
-        st.session_state.loop.run_until_complete(st.session_state.client.disconnect())
+        phone = st.session_state.phone
+        pool.release(phone)
         del st.session_state.client
-    session_file = None
-    for f in os.listdir("."):
-        if f.startswith("session_") and f.endswith(".session"):
-            session_file = f
-            break
-    if session_file:
-        os.remove(session_file)
+        del st.session_state.phone
+        if os.path.exists("session_" + phone + ".session"):
+            os.remove("session_" + phone + ".session")
+    discard_run()
+    st.session_state.awaiting_code = False
+    st.session_state.awaiting_password = False
     st.success(MESSAGES["reset_success"][lang])
 
 # -------------------------------------------
@@ -263,13 +296,11 @@ if st.button(MESSAGES["sign_in"][lang]):
         else:
             with st.spinner(MESSAGES["signing_in_spinner"][lang]):
                 try:
-                    client = st.session_state.loop.run_until_complete(
-                        async_get_telegram_client(api_id_int, api_hash_input, phone_input)
-                    )
+                    client = pool.get_client(api_id_int, api_hash_input, phone_input)
                     st.session_state.client = client
                     st.session_state.phone = phone_input
-                    if not st.session_state.loop.run_until_complete(client.is_user_authorized()):
-                        st.session_state.loop.run_until_complete(client.send_code_request(phone_input))
+                    if not run_in_pool(client.is_user_authorized()):
+                        run_in_pool(client.send_code_request(phone_input))
                         st.session_state.awaiting_code = True
                         st.info(MESSAGES["awaiting_code_msg"][lang])
                     else:
@@ -285,9 +316,7 @@ if st.session_state.get("awaiting_code", False):
     if st.button(MESSAGES["submit_code"][lang]):
         with st.spinner(MESSAGES["signing_in_with_code_spinner"][lang]):
             try:
-                st.session_state.loop.run_until_complete(
-                    st.session_state.client.sign_in(phone_input, auth_code)
-                )
+                run_in_pool(st.session_state.client.sign_in(phone_input, auth_code))
                 st.success(MESSAGES["sign_in_success"][lang])
                 st.session_state.awaiting_code = False
             except SessionPasswordNeededError:
@@ -305,9 +334,7 @@ if st.session_state.get("awaiting_password", False):
     if st.button(MESSAGES["submit_password"][lang]):
         with st.spinner(MESSAGES["signing_in_with_code_spinner"][lang]):
             try:
-                st.session_state.loop.run_until_complete(
-                    st.session_state.client.sign_in(password=password)
-                )
+                run_in_pool(st.session_state.client.sign_in(password=password))
                 st.success(MESSAGES["sign_in_success"][lang])
                 st.session_state.awaiting_password = False
             except Exception as e:
@@ -319,44 +346,194 @@ if st.session_state.get("awaiting_password", False):
 if "client" in st.session_state and not st.session_state.get("awaiting_code", False) and not st.session_state.get("awaiting_password", False):
     st.header(MESSAGES["step2"][lang])
     links_input = st.text_area(MESSAGES["enter_links"][lang])
+    expand_albums = st.checkbox(MESSAGES["expand_albums"][lang])
+    with st.expander(MESSAGES["fetch_settings"][lang]):
+        concurrency = st.number_input(MESSAGES["concurrency"][lang], min_value=1, max_value=32, value=DEFAULT_CONCURRENCY)
+        global_rate = st.number_input(MESSAGES["global_rate"][lang], min_value=0.1, value=DEFAULT_GLOBAL_RATE)
+        channel_rate = st.number_input(MESSAGES["channel_rate"][lang], min_value=0.1, value=DEFAULT_CHANNEL_RATE)
+        max_flood_wait = st.number_input(MESSAGES["max_flood_wait"][lang], min_value=1, value=DEFAULT_MAX_FLOOD_WAIT)
+        cache_ttl_minutes = st.number_input(MESSAGES["cache_ttl"][lang], min_value=0, value=DEFAULT_CACHE_TTL // 60)
+        force_refresh = st.checkbox(MESSAGES["force_refresh"][lang])
+        other_accounts = {
+            phone: client for phone, client in pool.authorized_clients().items()
+            if phone != st.session_state.phone
+        }
+        use_all_accounts = st.checkbox(
+            MESSAGES["use_all_accounts"][lang].format(count=len(other_accounts) + 1),
+            disabled=not other_accounts,
+        )
+        st.caption(MESSAGES["pool_stats"][lang].format(**pool.stats()))
+    job_mode = st.checkbox(MESSAGES["job_mode"][lang])
+
+    def build_scheduler(cache):
+        # Returns a scheduler with the fetch settings above, and the entity
+        # caches it uses, for the caller to close. Each extra account resolves
+        # channels with its own entity cache, since access hashes are only
+        # valid for the account that obtained them.
+        entity_cache = EntityCache(st.session_state.phone)
+        extra_accounts = [
+            (client, EntityCache(phone)) for phone, client in other_accounts.items()
+        ] if use_all_accounts else []
+        scheduler = pool.track(FetchScheduler(
+            st.session_state.client, concurrency, global_rate, channel_rate,
+            cache=cache, entity_cache=entity_cache, extra_accounts=extra_accounts,
+            max_flood_wait=max_flood_wait,
+        ))
+        return scheduler, [entity_cache] + [extra_entity_cache for _, extra_entity_cache in extra_accounts]
+    links = None
+    job = None
     if st.button(MESSAGES["sign_in"][lang] + " & " + MESSAGES["step2"][lang]):
         if links_input:
-            links = [link.strip() for link in re.split(r"[\s,]+", links_input) if link.strip()]
-            st.write(MESSAGES["processed_links"][lang], ", ".join(links))
+            links = split_links(links_input)
+            st.write(MESSAGES["processed_links"][lang], len(links))
+            if job_mode:
+                job = Job.create(links, options={"expand_albums": expand_albums})
+        else:
+            st.error(MESSAGES["no_links_error"][lang])
+    resume_job_id = st.text_input(MESSAGES["resume_job_id"][lang])
+    if st.button(MESSAGES["resume_job"][lang]):
+        try:
+            job = Job.load(resume_job_id.strip())
+        except (FileNotFoundError, ValueError):
+            st.error(MESSAGES["job_not_found"][lang].format(job_id=resume_job_id))
+
+    if links or job:
+        # Rows are streamed to a CSV on disk as they arrive; only lightweight
+        # references to the messages are kept in the session.
+        run_dir = tempfile.mkdtemp(prefix="tg_run_")
+        csv_path = os.path.join(run_dir, "telegram_messages.csv")
+        raw_path = os.path.join(run_dir, "telegram_messages_raw.jsonl")
+        row_counter = st.empty()
+
+        def show_row_count(count):
+            if count % ROW_COUNT_INTERVAL == 0:
+                text = MESSAGES["rows_retrieved"][lang].format(count=count)
+                ui_updates.put(lambda: row_counter.write(text))
+
+        cache = MessageCache(ttl=cache_ttl_minutes * 60, force_refresh=force_refresh)
+        scheduler, entity_caches = build_scheduler(cache)
+        # Only the ids of each album's members are memoised for the session;
+        # the messages themselves come through the message cache.
+        album_cache = st.session_state.setdefault("album_cache", {})
+        try:
             with st.spinner(MESSAGES["retrieving_data_spinner"][lang]):
-                results, raw_messages = st.session_state.loop.run_until_complete(
-                    process_messages(st.session_state.client, links)
-                )
-            if results:
-                df = pd.DataFrame(results)
-                st.subheader(MESSAGES["retrieved_data"][lang])
-                st.dataframe(df)
-                csv = df.to_csv(index=False).encode("utf-8")
-                st.download_button(
-                    label=MESSAGES["download_csv"][lang],
-                    data=csv,
-                    file_name="telegram_messages.csv",
-                    mime="text/csv"
-                )
-            else:
-                st.warning(MESSAGES["no_message_data_warning"][lang])
-            if raw_messages:
-                st.subheader(MESSAGES["raw_message_objects"][lang])
-                for link, message in raw_messages:
-                    with st.expander(f"Message from {link}"):
-                        st.text_area(MESSAGES["message_object"][lang], value=str(message), height=200, disabled=True)
-            # Check if any raw message has media
-            if any(message.media for _, message in raw_messages):
-                if st.button(MESSAGES["download_all_media"][lang]):
-                    with st.spinner(MESSAGES["downloading_media_spinner"][lang]):
-                        zip_bytes = st.session_state.loop.run_until_complete(
-                            download_all_media(st.session_state.client, raw_messages)
+                if job:
+                    st.info(MESSAGES["job_started"][lang].format(job_id=job.job_id))
+                    summary = run_in_pool(
+                        job.run(st.session_state.client, scheduler, album_cache, progress=report_progress)
+                    )
+                    st.info(MESSAGES["job_summary"][lang].format(**summary))
+                    records = job.finalize(csv_path, raw_path)
+                else:
+                    records = run_in_pool(
+                        export_messages(
+                            st.session_state.client, links, csv_path,
+                            raw_path=raw_path,
+                            on_row=show_row_count,
+                            scheduler=scheduler,
+                            expand_albums=expand_albums,
+                            album_cache=album_cache,
+                            progress=report_progress,
                         )
-                    st.download_button(
-                        label=MESSAGES["download_all_media"][lang],
-                        data=zip_bytes,
-                        file_name="media.zip",
-                        mime="application/zip"
                     )
+        except BaseException:
+            shutil.rmtree(run_dir, ignore_errors=True)
+            raise
+        finally:
+            cache.close()
+            for entity_cache in entity_caches:
+                entity_cache.close()
+        row_counter.empty()
+        discard_run()
+        st.session_state.run = {
+            "dir": run_dir,
+            "csv_path": csv_path,
+            "raw_path": raw_path,
+            "records": records,
+            "fetch_stats": scheduler.stats(),
+            "cache_stats": cache.stats(),
+        }
+
+    # -------------------------------------------
+    # Streamlit UI - Results of the last run
+    # -------------------------------------------
+    # Kept in the session so paging, inspecting messages and downloading media
+    # keep working across the reruns those widgets trigger.
+    run = st.session_state.get("run")
+    if run:
+        records = run["records"]
+        st.info(MESSAGES["fetch_stats"][lang].format(**run["fetch_stats"]))
+        st.info(MESSAGES["cache_stats"][lang].format(**run["cache_stats"]))
+        if records:
+            st.subheader(MESSAGES["retrieved_data"][lang])
+            page_count = (len(records) + PAGE_SIZE - 1) // PAGE_SIZE
+            page = st.number_input(
+                MESSAGES["page"][lang].format(pages=page_count, rows=len(records)),
+                min_value=1, max_value=page_count, value=1,
+            )
+            first_row = (page - 1) * PAGE_SIZE
+            page_rows = pd.read_csv(
+                run["csv_path"], skiprows=range(1, first_row + 1), nrows=PAGE_SIZE,
+                # Every page shows the values as written, whatever pandas
+                # would infer from the rows that happen to be on it.
+                dtype=str, keep_default_na=False,
+            )
+            # Number the rows as in the whole result, to match the row inspector below.
+            page_rows.index = range(first_row + 1, first_row + 1 + len(page_rows))
+            st.dataframe(page_rows)
+            st.download_button(
+                label=MESSAGES["download_csv"][lang],
+                data=deferred_file(run["csv_path"]),
+                file_name="telegram_messages.csv",
+                mime="text/csv"
+            )
+
+            # Raw objects are read from the canonical JSONL export one at a time, on demand.
+            st.subheader(MESSAGES["raw_message_objects"][lang])
+            st.download_button(
+                label=MESSAGES["download_raw_json"][lang],
+                data=deferred_file(run["raw_path"]),
+                file_name="telegram_messages_raw.jsonl",
+                mime="application/x-ndjson"
+            )
+            row_number = st.number_input(
+                MESSAGES["inspect_row"][lang], min_value=0, max_value=len(records), value=0
+            )
+            if row_number:
+                raw_record = json.loads(read_raw_record(run["raw_path"], row_number - 1))
+                st.write(MESSAGES["message_hash"][lang].format(link=raw_record["link"], sha256=raw_record["sha256"]))
+                st.code(json.dumps(raw_record["message"], indent=2, ensure_ascii=False), language="json")
         else:
-            st.error(MESSAGES["no_links_error"][lang])
+            st.warning(MESSAGES["no_message_data_warning"][lang])
+
+        # Check if any retrieved message has media
+        if any(record.has_media for record in records):
+            if st.button(MESSAGES["download_all_media"][lang]):
+                # Messages evicted from the cache or past its TTL since the
+                # run are fetched again.
+                cache = MessageCache(ttl=cache_ttl_minutes * 60)
+                scheduler, entity_caches = build_scheduler(cache)
+                zip_path = os.path.join(run["dir"], "media.zip")
+                try:
+                    with st.spinner(MESSAGES["downloading_media_spinner"][lang]):
+                        raw_messages = run_in_pool(
+                            load_messages(scheduler, records, media_only=True, progress=report_progress)
+                        )
+                        run["media_stats"] = run_in_pool(
+                            download_all_media(st.session_state.client, raw_messages, zip_path, progress=report_progress)
+                        )
+                finally:
+                    cache.close()
+                    for entity_cache in entity_caches:
+                        entity_cache.close()
+                run["media_zip"] = zip_path
+            if "media_zip" in run:
+                st.info(MESSAGES["media_stats"][lang].format(**run["media_stats"]))
+                if run["media_stats"]["peak_megabytes"] is not None:
+                    st.caption(MESSAGES["peak_memory"][lang].format(**run["media_stats"]))
+                st.download_button(
+                    label=MESSAGES["download_all_media"][lang],
+                    data=deferred_file(run["media_zip"]),
+                    file_name="media.zip",
+                    mime="application/zip"
+                )
@@ -0,0 +1,143 @@
+"""Offline end-to-end benchmark of the fetch, export and media pipeline.
+
+    python benchmarks/bench_pipeline.py [--scenario 10 1k 100k media] [--latency 0.05]
+        [--flood-every 0] [--media-gb 2] [--workdir /tmp]
+
+Runs export_messages (and download_all_media where the scenario includes
+media) against FakeTelegramClient instead of Telegram, inside a
+StageProfiler, and prints the calls, time and memory in use for each
+pipeline stage (parse, resolve, fetch, flatten, export, download, zip),
+so throughput and memory regressions show up as numbers. Caches, outputs
+and the media store live in a temporary directory removed afterwards; the
+media scenario needs --media-gb of free disk space there, twice over.
+
+Rate limits are off by default so the pipeline itself is measured rather
+than the scheduler's spacing; pass --global-rate/--channel-rate to include
+them.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_telegram import MEGABYTE, FakeTelegramClient  # noqa: E402
+from scraper import (  # noqa: E402
+    DEFAULT_CONCURRENCY,
+    DEFAULT_DOWNLOAD_CONCURRENCY,
+    EntityCache,
+    FetchScheduler,
+    MediaStore,
+    MessageCache,
+    StageProfiler,
+    download_all_media,
+    export_messages,
+    load_messages,
+)
+
+# links: number of links; channels: how many channels they are spread over;
+# media: whether to download the linked media afterwards; media_every: every
+# nth message carries a document (1 for the media scenario, whose files
+# together add up to --media-gb).
+SCENARIOS = {
+    "10": {"links": 10, "channels": 2, "media": True, "media_every": 3},
+    "1k": {"links": 1000, "channels": 20, "media": True, "media_every": 3},
+    "100k": {"links": 100000, "channels": 200, "media": False, "media_every": 3},
+    "media": {"links": 64, "channels": 4, "media": True, "media_every": 1},
+}
+
+def build_links(count, channels):
+    return [f"https://t.me/bench{index % channels}/{index // channels + 1}" for index in range(count)]
+
+def print_report(profiler):
+    print(f"  {'stage':<10} {'calls':>8} {'seconds':>10} {'ms/call':>10} {'max MB':>10}")
+    for name, stats in profiler.report().items():
+        print(
+            f"  {name:<10} {stats['calls']:>8,} {stats['seconds']:>10.3f} "
+            f"{stats['seconds'] * 1000 / stats['calls']:>10.3f} {stats['memory'] / MEGABYTE:>10.2f}"
+        )
+    print(f"  total {profiler.elapsed:.3f}s, peak traced memory {profiler.peak / MEGABYTE:.1f} MB")
+
+async def run_scenario(name, args, workdir):
+    scenario = SCENARIOS[name]
+    links = build_links(scenario["links"], scenario["channels"])
+    media_size = args.media_size * 1024
+    if name == "media":
+        media_size = int(args.media_gb * 1024 * MEGABYTE / scenario["links"])
+    client = FakeTelegramClient(
+        latency=args.latency,
+        flood_every=args.flood_every,
+        flood_seconds=args.flood_seconds,
+        media_every=scenario["media_every"],
+        media_size=media_size,
+        download_rate=args.download_rate,
+    )
+    cache = MessageCache(os.path.join(workdir, "message_cache.sqlite"), ttl=0)
+    entity_cache = EntityCache("bench", os.path.join(workdir, "entity_cache.sqlite"))
+    scheduler = FetchScheduler(
+        client, args.concurrency, args.global_rate, args.channel_rate,
+        cache=cache, entity_cache=entity_cache,
+    )
+    store = MediaStore(os.path.join(workdir, "media_store"))
+    print(f"scenario {name}: {len(links):,} links over {scenario['channels']} channel(s)")
+    try:
+        with StageProfiler(trace_memory=not args.no_tracemalloc) as profiler:
+            start = time.perf_counter()
+            records = await export_messages(
+                client, links, os.path.join(workdir, "messages.csv"),
+                raw_path=os.path.join(workdir, "messages_raw.jsonl"),
+                scheduler=scheduler, progress=lambda *args, **details: None,
+            )
+            export_elapsed = time.perf_counter() - start
+            media_stats = None
+            if scenario["media"]:
+                raw_messages = await load_messages(
+                    scheduler, records, media_only=True, progress=lambda *args, **details: None,
+                )
+                media_stats = await download_all_media(
+                    client, raw_messages, os.path.join(workdir, "media.zip"),
+                    args.download_concurrency, store, progress=lambda *args, **details: None,
+                )
+    finally:
+        cache.close()
+        entity_cache.close()
+        store.close()
+    print_report(profiler)
+    fetch_stats = scheduler.stats()
+    print(
+        f"  export: {len(records):,} rows in {export_elapsed:.3f}s ({len(records) / export_elapsed:,.0f} rows/s), "
+        f"{fetch_stats['requests']:,} request(s), {fetch_stats['flood_waits']} flood wait(s)"
+    )
+    if media_stats:
+        print(
+            f"  media: {media_stats['files']:,} file(s), {media_stats['megabytes']:,.1f} MB in "
+            f"{media_stats['elapsed']:.3f}s ({media_stats['rate']:,.1f} MB/s)"
+        )
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=["10", "1k", "100k"])
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every fake request")
+    parser.add_argument("--flood-every", type=int, default=0, help="Every nth request raises a flood wait (0 = never)")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--media-size", type=int, default=256, help="Size of each media file in KB")
+    parser.add_argument("--media-gb", type=float, default=2.0, help="Total media size of the media scenario")
+    parser.add_argument("--download-rate", type=float, default=0.0, help="Simulated download speed in MB/s (0 = unlimited)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--download-concurrency", type=int, default=DEFAULT_DOWNLOAD_CONCURRENCY)
+    parser.add_argument("--global-rate", type=float, default=0.0)
+    parser.add_argument("--channel-rate", type=float, default=0.0)
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip memory tracing, which slows Python down")
+    parser.add_argument("--workdir", help="Directory for the temporary files (default: system temp)")
+    args = parser.parse_args()
+
+    for name in args.scenario:
+        with tempfile.TemporaryDirectory(prefix="tg_bench_", dir=args.workdir) as workdir:
+            asyncio.run(run_scenario(name, args, workdir))
+
+if __name__ == "__main__":
+    main()
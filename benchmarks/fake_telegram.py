@@ -0,0 +1,115 @@
+"""Offline stand-in for a connected TelegramClient, for benchmarks.
+
+Implements the calls the pipeline makes (get_input_entity, get_messages,
+download_media) against synthetic channels, with configurable latency,
+flood-wait injection and payload sizes, so the pipeline can be measured
+without an account or network access.
+"""
+import asyncio
+import datetime
+import os
+import zlib
+
+from telethon._updates import EntityCache
+from telethon.errors import FloodWaitError
+from telethon.tl import patched, types
+
+MEGABYTE = 1024 * 1024
+WRITE_CHUNK_SIZE = MEGABYTE
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+def channel_id_for(channel_identifier):
+    if isinstance(channel_identifier, int):
+        return abs(channel_identifier) % 10 ** 12
+    return zlib.crc32(str(channel_identifier).lower().encode()) + 1
+
+class FakeTelegramClient:
+    def __init__(self, latency=0.05, flood_every=0, flood_seconds=1, text_size=200,
+                 media_every=3, media_size=256 * 1024, download_rate=0.0, missing_every=0):
+        # latency: seconds added to every request.
+        # flood_every: every nth get_messages call raises FloodWaitError
+        #   (0 = never), asking for a wait of flood_seconds.
+        # media_every: every nth message id carries a document of media_size
+        #   bytes (0 = no media).
+        # download_rate: simulated download speed in MB/s (0 = unlimited).
+        # missing_every: every nth message id does not exist (0 = none).
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.text = ("lorem ipsum " * (text_size // 12 + 1))[:text_size]
+        self.media_every = media_every
+        self.media_size = media_size
+        self.download_rate = download_rate
+        self.missing_every = missing_every
+        self.requests = 0
+        self.downloads = 0
+        self.flood_sleep_threshold = 60
+        # Used by Message._finish_init when messages are loaded from the cache.
+        self._self_id = 1
+        self._mb_entity_cache = EntityCache()
+
+    def is_connected(self):
+        return True
+
+    async def is_user_authorized(self):
+        return True
+
+    async def disconnect(self):
+        pass
+
+    async def get_input_entity(self, channel_identifier):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return types.InputPeerChannel(channel_id_for(channel_identifier), access_hash=7)
+
+    async def get_messages(self, peer, ids):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.flood_every and self.requests % self.flood_every == 0:
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        return [self.message(peer.channel_id, message_id) for message_id in ids]
+
+    def message(self, channel_id, message_id):
+        if self.missing_every and message_id % self.missing_every == 0:
+            return None
+        media = None
+        if self.media_every and message_id % self.media_every == 0:
+            media = types.MessageMediaDocument(document=types.Document(
+                id=channel_id * 10 ** 7 + message_id,
+                access_hash=channel_id,
+                file_reference=b"",
+                date=EPOCH,
+                mime_type="video/mp4",
+                size=self.media_size,
+                dc_id=2,
+                attributes=[types.DocumentAttributeFilename("{}_{}.mp4".format(channel_id, message_id))],
+            ))
+        return patched.Message(
+            id=message_id,
+            peer_id=types.PeerChannel(channel_id),
+            date=EPOCH + datetime.timedelta(minutes=message_id),
+            message=self.text,
+            views=message_id * 10,
+            forwards=message_id,
+            post=True,
+            media=media,
+        )
+
+    async def download_media(self, media, file):
+        # Writes media_size bytes to a new file in the directory `file`. Every
+        # file starts with its document id, so no two documents hash the same.
+        self.downloads += 1
+        await asyncio.sleep(self.latency)
+        document = media.document
+        path = os.path.join(file, document.attributes[0].file_name)
+        header = str(document.id).encode().ljust(64, b"\0")
+        chunk = bytes(WRITE_CHUNK_SIZE)
+        with open(path, "wb") as f:
+            f.write(header)
+            remaining = max(0, document.size - len(header))
+            while remaining:
+                written = f.write(chunk[:min(remaining, WRITE_CHUNK_SIZE)])
+                remaining -= written
+                if self.download_rate:
+                    await asyncio.sleep(written / (self.download_rate * MEGABYTE))
+        return path
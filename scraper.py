@@ -0,0 +1,1620 @@
+import asyncio
+import base64
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+import weakref
+import zipfile
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from telethon.extensions import BinaryReader
+from telethon.tl import types
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------
+# Progress reporting
+# -------------------------------------------
+# The pipeline reports progress through a callback taking
+# (level, event, **details), where level is "info", "warning" or "error".
+# Front ends map the event names to their own messages; the default
+# callback logs the English templates below.
+PROGRESS_MESSAGES = {
+    "link_not_recognised": "Link not recognised: {link}",
+    "unresolved_channel": "Could not resolve {channel} ({count} link(s) skipped): {error}",
+    "processing_batch": "Fetching {count} message(s) from {channel}",
+    "fetch_error": "Error fetching {link}: {error}",
+    "no_message_found": "No message found for link: {link}",
+    "media_error": "Could not download media for {link}: {error}",
+    "media_not_loaded": "Could not load the message with media for {link}: {error}",
+}
+
+LOG_LEVELS = {"info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+def log_progress(level, event, **details):
+    logger.log(LOG_LEVELS[level], PROGRESS_MESSAGES[event].format(**details))
+
+# -------------------------------------------
+# Stage profiling
+# -------------------------------------------
+# The pipeline stages are wrapped in profile_stage(name). It does nothing
+# unless a StageProfiler is active, so benchmarks get per-stage time and
+# memory without slowing down normal runs.
+PIPELINE_STAGES = ("parse", "resolve", "fetch", "flatten", "export", "download", "zip")
+active_profiler = None
+NOT_PROFILED = contextlib.nullcontext()
+
+def profile_stage(name):
+    return active_profiler.stage(name) if active_profiler else NOT_PROFILED
+
+class StageProfiler:
+    # Records, per stage, the number of calls, the total seconds spent in them
+    # and the most traced memory in use as one of them finished. Async stages
+    # run concurrently, so their seconds can add up to more than the
+    # wall-clock time; resolve and fetch time the Telegram requests once a
+    # request slot is free, not the wait for one. Tracing
+    # memory slows Python down noticeably, so it can be turned off when only
+    # the timings matter.
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.peak = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        global active_profiler
+        self.previous = active_profiler
+        active_profiler = self
+        self.started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global active_profiler
+        self.elapsed = time.perf_counter() - self.start
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        if self.started_tracing:
+            tracemalloc.stop()
+        active_profiler = self.previous
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            memory, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            stats = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "memory": 0})
+            stats["calls"] += 1
+            stats["seconds"] += elapsed
+            stats["memory"] = max(stats["memory"], memory)
+
+    def report(self):
+        # Returns {stage: stats} in pipeline order, with the stages that never
+        # ran left out.
+        return {name: self.stages[name] for name in PIPELINE_STAGES if name in self.stages}
+
+# -------------------------------------------
+# Asynchronous functions for Telegram operations
+# -------------------------------------------
+async def async_get_telegram_client(api_id, api_hash, phone):
+    # Use a session file name that includes the phone number.
+    client = TelegramClient("session_" + phone, api_id, api_hash)
+    await client.connect()  # Connect without interactive prompts.
+    return client
+
+class ClientPool:
+    # Process-wide pool of connected clients keyed by phone number. All clients
+    # live on one event loop running in a background thread, so every caller
+    # (each Streamlit session runs in its own thread) reuses the same warm,
+    # authorised connection instead of opening a new one per session.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="telegram-client-pool", daemon=True)
+        self.thread.start()
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.schedulers = weakref.WeakSet()
+        self.pending = 0
+
+    def run(self, coroutine, on_wait=None):
+        # Runs coroutine on the pool's loop and blocks until it finishes. on_wait
+        # is called while waiting, so the calling thread can handle anything the
+        # coroutine hands back to it (such as UI updates).
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        with self.lock:
+            self.pending += 1
+        try:
+            while True:
+                try:
+                    return future.result(timeout=0.1)
+                except concurrent.futures.TimeoutError:
+                    if on_wait:
+                        on_wait()
+        except BaseException:
+            # The caller gave up waiting (a Streamlit rerun raises from
+            # on_wait, for instance), so the coroutine must not run on.
+            future.cancel()
+            raise
+        finally:
+            with self.lock:
+                self.pending -= 1
+            if on_wait:
+                on_wait()
+
+    def get_client(self, api_id, api_hash, phone):
+        # Returns the pooled client for phone, connecting it first if needed.
+        with self.lock:
+            client = self.clients.get(phone)
+        if client is not None and client.is_connected():
+            return client
+        client = self.run(async_get_telegram_client(api_id, api_hash, phone))
+        with self.lock:
+            self.clients[phone] = client
+        return client
+
+    def authorized_clients(self):
+        # Returns {phone: client} for the pooled clients that are signed in.
+        with self.lock:
+            clients = dict(self.clients)
+        return {
+            phone: client for phone, client in clients.items()
+            if client.is_connected() and self.run(client.is_user_authorized())
+        }
+
+    def release(self, phone):
+        # Disconnects and drops the client for phone, if there is one.
+        with self.lock:
+            client = self.clients.pop(phone, None)
+        if client is not None:
+            self.run(client.disconnect())
+
+    def track(self, scheduler):
+        self.schedulers.add(scheduler)
+        return scheduler
+
+    def stats(self):
+        with self.lock:
+            clients = sum(1 for client in self.clients.values() if client.is_connected())
+            pending = self.pending
+        return {
+            "clients": clients,
+            "pending": pending,
+            "queued": sum(scheduler.queued for scheduler in list(self.schedulers)),
+        }
+
+# -------------------------------------------
+# Link normalization (handles username, /c/ chat, /s/ preview and tg:// links)
+# -------------------------------------------
+# t.me and telegram.me links, optionally to the /s/ web preview or to a post
+# inside a forum topic (…/<topic>/<post>), and the tg://resolve?domain=…&post=…
+# and tg://privatepost?channel=…&post=… deep links. Query strings such as
+# ?single or ?comment= do not change which post is linked, so they are ignored.
+LINK_ALTERNATIVES = (
+    r"(?:telegram|t)\.me/(?:c/(\d+)|(?:s/)?([A-Za-z0-9_]+))/(?:\d+/)?(\d+)"
+    r"|tg://(resolve|privatepost)\?([^#\s]*)"
+)
+LINK_PATTERN = re.compile(LINK_ALTERNATIVES)
+TG_QUERY_PARAM = re.compile(r"(?:^|&)(domain|channel|post)=([A-Za-z0-9_]+)")
+
+def canonical_link(chat_id, username, post, kind, query):
+    # Builds (canonical_link, channel_identifier, message_id) from the groups of
+    # LINK_PATTERN, or returns None. Usernames are case-insensitive, so they are
+    # lower-cased and the canonical link is the same for every spelling.
+    if kind:
+        params = dict(TG_QUERY_PARAM.findall(query))
+        post = params.get("post", "")
+        if kind == "resolve":
+            username = params.get("domain")
+        else:
+            chat_id = params.get("channel", "")
+            if not chat_id.isdigit():
+                return None
+        if not post.isdigit() or not (username or chat_id):
+            return None
+    elif not post:
+        return None
+    message_id = int(post)
+    if chat_id:
+        # For t.me/c/ links, the channel identifier is calculated as follows:
+        # Actual channel id = -(int(part) + 1000000000000)
+        return f"https://t.me/c/{chat_id}/{message_id}", -(int(chat_id) + 1000000000000), message_id
+    username = username.lower()
+    return f"https://t.me/{username}/{message_id}", username, message_id
+
+def normalize_link(link):
+    # Returns (canonical_link, channel_identifier, message_id), or None if the
+    # link is not recognised.
+    match = LINK_PATTERN.search(link)
+    return canonical_link(*match.groups()) if match else None
+
+def normalize_links(links):
+    # Canonicalizes and dedupes links before anything is fetched. Returns the
+    # distinct (canonical_link, channel_identifier, message_id) entries in
+    # first-seen order, and for every input position the index of its entry
+    # (None when the link is not recognised).
+    #
+    # Each distinct input string is parsed only once.
+    distinct = list(dict.fromkeys(links))
+    groups = [match.groups() if match else None for match in map(LINK_PATTERN.search, distinct)]
+    entries = []
+    entry_index = {}
+    parsed = {}
+    for link, link_groups in zip(distinct, groups):
+        if link_groups is None:
+            parsed[link] = None
+            continue
+        chat_id, username, post, kind, query = link_groups
+        # Plain t.me/<username>/<post> links are by far the most common, so
+        # they are keyed without going through canonical_link.
+        if username and post:
+            entry = None
+            key = (username.lower(), int(post))
+        else:
+            entry = canonical_link(*link_groups)
+            if entry is None:
+                parsed[link] = None
+                continue
+            key = entry[1:]
+        index = entry_index.get(key)
+        if index is None:
+            index = entry_index[key] = len(entries)
+            entries.append(entry or (f"https://t.me/{key[0]}/{key[1]}",) + key)
+        parsed[link] = index
+    return entries, [parsed[link] for link in links]
+
+def process_link(link):
+    normalized = normalize_link(link)
+    if normalized is None:
+        return None, None
+    return normalized[1], normalized[2]
+
+def display_channel_name(channel_identifier):
+    return channel_identifier if isinstance(channel_identifier, str) else f"Chat {channel_identifier}"
+
+# Telegram accepts up to 100 message ids in a single get_messages call.
+MAX_IDS_PER_REQUEST = 100
+
+def chunk_ids(message_ids, size=MAX_IDS_PER_REQUEST):
+    for i in range(0, len(message_ids), size):
+        yield message_ids[i:i + size]
+
+async def get_message_data(client, channel_identifier, message_ids):
+    # Returns a list aligned with message_ids; missing or deleted messages are None.
+    # Flood waits are left to the caller so the request can be retried.
+    try:
+        messages = await client.get_messages(channel_identifier, ids=list(message_ids))
+    except FloodWaitError:
+        raise
+    except Exception as e:
+        return None, str(e)
+    return list(messages), None
+
+async def resolve_entity(client, channel_identifier):
+    try:
+        peer = await client.get_input_entity(channel_identifier)
+    except FloodWaitError:
+        raise
+    except Exception as e:
+        return None, str(e)
+    return peer, None
+
+def channel_key(channel_identifier):
+    # Usernames are case-insensitive on Telegram.
+    return str(channel_identifier).lower()
+
+# -------------------------------------------
+# Persistent entity resolution cache
+# -------------------------------------------
+ENTITY_CACHE_PATH = "entity_cache.sqlite"
+# Usernames can change hands, so resolutions are refreshed after a week.
+DEFAULT_ENTITY_TTL = 7 * 24 * 3600
+CACHEABLE_PEERS = (types.InputPeerChannel, types.InputPeerUser, types.InputPeerChat)
+
+class EntityCache:
+    # Access hashes are only valid for the account that obtained them, so
+    # entries are keyed by account (phone number) as well as identifier.
+    def __init__(self, account, path=ENTITY_CACHE_PATH, ttl=DEFAULT_ENTITY_TTL):
+        self.account = account
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entities ("
+                "account TEXT NOT NULL, identifier TEXT NOT NULL, peer BLOB NOT NULL, "
+                "resolved_at REAL NOT NULL, PRIMARY KEY (account, identifier))"
+            )
+
+    def lookup(self, channel_identifier):
+        row = self.conn.execute(
+            "SELECT peer, resolved_at FROM entities WHERE account = ? AND identifier = ?",
+            (self.account, channel_key(channel_identifier)),
+        ).fetchone()
+        if row is None or (self.ttl and time.time() - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return BinaryReader(row[0]).tgread_object()
+
+    def store(self, channel_identifier, peer):
+        if not isinstance(peer, CACHEABLE_PEERS):
+            return
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)",
+                (self.account, channel_key(channel_identifier), bytes(peer), time.time()),
+            )
+
+    def close(self):
+        self.conn.close()
+
+# -------------------------------------------
+# Persistent on-disk message cache keyed by (channel, message_id)
+# -------------------------------------------
+MESSAGE_CACHE_PATH = "message_cache.sqlite"
+# Views, forwards and reactions change over time, so entries older than the
+# TTL (in seconds) are refetched. A TTL of 0 keeps entries until evicted.
+DEFAULT_CACHE_TTL = 3600
+DEFAULT_CACHE_MAX_ENTRIES = 100000
+
+class MessageCache:
+    def __init__(self, path=MESSAGE_CACHE_PATH, ttl=DEFAULT_CACHE_TTL,
+                 max_entries=DEFAULT_CACHE_MAX_ENTRIES, force_refresh=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.force_refresh = force_refresh
+        self.hits = 0
+        self.misses = 0
+        # Flattened rows of the linked messages served or stored during this
+        # run, so iter_messages can reuse them instead of flattening again;
+        # each is dropped once it has been used.
+        self.rows = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "channel TEXT NOT NULL, message_id INTEGER NOT NULL, raw BLOB NOT NULL, "
+                "row TEXT NOT NULL, fetched_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (channel, message_id))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS messages_accessed_at ON messages (accessed_at)")
+
+    def lookup(self, client, channel_identifier, message_ids, linked=True):
+        # Returns {message_id: message} for the fresh entries among message_ids.
+        # Only linked messages count towards the hit rate and keep their rows.
+        if self.force_refresh:
+            if linked:
+                self.misses += len(message_ids)
+            return {}
+        channel = channel_key(channel_identifier)
+        now = time.time()
+        found = {}
+        for message_id, raw, row, fetched_at in self.select(channel, message_ids):
+            if self.ttl and now - fetched_at > self.ttl:
+                continue
+            found[message_id] = self.deserialize(client, raw)
+            if linked:
+                self.rows[(channel, message_id)] = json.loads(row)
+        if found:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE messages SET accessed_at = ? WHERE channel = ? AND message_id = ?",
+                    [(now, channel, message_id) for message_id in found],
+                )
+        if linked:
+            self.hits += len(found)
+            self.misses += len(message_ids) - len(found)
+        return found
+
+    def load(self, client, channel_identifier, message_ids):
+        # Like lookup, but ignores force_refresh and leaves the hit counts
+        # alone; used to bring back messages fetched earlier in a run. Entries
+        # past the TTL are still left out, as their file references may have
+        # expired.
+        now = time.time()
+        return {
+            message_id: self.deserialize(client, raw)
+            for message_id, raw, row, fetched_at in self.select(channel_key(channel_identifier), message_ids)
+            if not self.ttl or now - fetched_at <= self.ttl
+        }
+
+    def select(self, channel, message_ids):
+        placeholders = ",".join("?" * len(message_ids))
+        return self.conn.execute(
+            f"SELECT message_id, raw, row, fetched_at FROM messages "
+            f"WHERE channel = ? AND message_id IN ({placeholders})",
+            [channel, *message_ids],
+        ).fetchall()
+
+    @staticmethod
+    def deserialize(client, raw):
+        message = BinaryReader(raw).tgread_object()
+        message._finish_init(client, {}, None)
+        return message
+
+    def store(self, channel_identifier, messages, linked=True):
+        channel = channel_key(channel_identifier)
+        display_channel = display_channel_name(channel_identifier)
+        now = time.time()
+        entries = []
+        for message in messages:
+            if not message:
+                continue
+            row = flatten_message(message, display_channel)
+            if linked:
+                self.rows[(channel, message.id)] = row
+            entries.append((channel, message.id, bytes(message), json.dumps(row, default=str), now, now))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)", entries)
+
+    def row(self, channel_identifier, message):
+        row = self.rows.pop((channel_key(channel_identifier), message.id), None)
+        return row if row is not None else flatten_message(message, display_channel_name(channel_identifier))
+
+    def evict(self):
+        # Drop the least recently used entries beyond max_entries.
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()
+        if count > self.max_entries:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM messages WHERE rowid IN "
+                    "(SELECT rowid FROM messages ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+# -------------------------------------------
+# Bounded-concurrency fetch scheduler with rate limits and flood-wait handling
+# -------------------------------------------
+DEFAULT_CONCURRENCY = 4
+DEFAULT_GLOBAL_RATE = 10.0
+DEFAULT_CHANNEL_RATE = 2.0
+# Flood waits longer than this (in seconds) fail the request instead of being
+# slept through; resolving usernames in particular can be blocked for hours.
+DEFAULT_MAX_FLOOD_WAIT = 300
+
+class RateLimiter:
+    # Spaces calls to acquire() so that at most `rate` go through per second.
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class Account:
+    # A signed-in client the scheduler sends requests through. Flood waits,
+    # access hashes and rate limits all apply per account, so each one keeps
+    # its own entity cache, request slots and flood-wait state.
+    def __init__(self, client, entity_cache=None, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_GLOBAL_RATE):
+        self.client = client
+        self.entity_cache = entity_cache
+        self.semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+        self.limiter = RateLimiter(rate)
+        self.resume_at = 0.0
+
+# Clients can be shared by several schedulers at once (pooled clients, two
+# sessions on one account), so the flood_sleep_threshold each batch turns off
+# is kept per client, with the number of batches using it, and only restored
+# when the last of them ends.
+suspended_flood_sleep = weakref.WeakKeyDictionary()
+
+def suspend_flood_sleep(client):
+    if client not in suspended_flood_sleep:
+        suspended_flood_sleep[client] = [client.flood_sleep_threshold, 0]
+        client.flood_sleep_threshold = 0
+    suspended_flood_sleep[client][1] += 1
+
+def restore_flood_sleep(client):
+    suspended = suspended_flood_sleep[client]
+    suspended[1] -= 1
+    if suspended[1] == 0:
+        client.flood_sleep_threshold = suspended[0]
+        del suspended_flood_sleep[client]
+
+class FetchScheduler:
+    # Requests for a channel always go through the same account, since the
+    # resolved peer is only valid for the account that resolved it. With
+    # extra_accounts (a list of (client, entity_cache) pairs) the channels are
+    # spread round-robin across all of them, so the concurrency and global
+    # rate apply per account.
+    def __init__(self, client, concurrency=DEFAULT_CONCURRENCY,
+                 global_rate=DEFAULT_GLOBAL_RATE, channel_rate=DEFAULT_CHANNEL_RATE,
+                 cache=None, entity_cache=None, extra_accounts=(), max_flood_wait=DEFAULT_MAX_FLOOD_WAIT):
+        self.client = client
+        self.max_flood_wait = max_flood_wait
+        self.cache = cache
+        self.concurrency = max(1, int(concurrency))
+        self.accounts = [
+            Account(account_client, account_entity_cache, self.concurrency, global_rate)
+            for account_client, account_entity_cache in [(client, entity_cache), *extra_accounts]
+        ]
+        self.channel_accounts = {}
+        # Resolved input peers by channel identifier, used for every request.
+        self.peers = {}
+        self.channel_rate = channel_rate
+        self.channel_limiters = {}
+        self.requests = 0
+        self.queued = 0
+        self.messages = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+        self.elapsed = 0.0
+        self.active = 0
+
+    def account_for(self, channel_identifier):
+        if channel_identifier not in self.channel_accounts:
+            self.channel_accounts[channel_identifier] = self.accounts[len(self.channel_accounts) % len(self.accounts)]
+        return self.channel_accounts[channel_identifier]
+
+    def accounts_to_try(self, channel_identifier):
+        # The channel's own account first, then the others.
+        account = self.account_for(channel_identifier)
+        return [account] + [other for other in self.accounts if other is not account]
+
+    def channel_limiter(self, channel_identifier):
+        if channel_identifier not in self.channel_limiters:
+            self.channel_limiters[channel_identifier] = RateLimiter(self.channel_rate)
+        return self.channel_limiters[channel_identifier]
+
+    def record_flood_wait(self, account, seconds):
+        # A flood wait applies to the whole account, so every worker using it
+        # pauses until it has passed. Only the wall-clock time added is
+        # counted, so overlapping waits from concurrent workers are not double
+        # counted.
+        now = time.monotonic()
+        resume_at = now + seconds
+        if resume_at > account.resume_at:
+            self.flood_wait_seconds += resume_at - max(account.resume_at, now)
+            account.resume_at = resume_at
+        self.flood_waits += 1
+
+    async def fetch(self, channel_identifier, message_ids, linked=True):
+        # Cached messages are served without touching the rate limits; only
+        # the misses are requested from Telegram and then stored. linked is
+        # False for messages fetched around the linked ones (album ranges),
+        # which the cache neither counts nor keeps rows for.
+        cached = self.cache.lookup(self.client, channel_identifier, message_ids, linked) if self.cache else {}
+        missing = [message_id for message_id in message_ids if message_id not in cached]
+        if not missing:
+            return [cached[message_id] for message_id in message_ids], None
+        messages, error = await self.fetch_from_telegram(channel_identifier, missing)
+        if error:
+            return None, error
+        if self.cache:
+            self.cache.store(channel_identifier, messages, linked)
+        fetched = dict(zip(missing, messages))
+        fetched.update(cached)
+        return [fetched[message_id] for message_id in message_ids], None
+
+    async def fetch_from_telegram(self, channel_identifier, message_ids):
+        peer = self.peers.get(channel_identifier, channel_identifier)
+        messages, error = await self.throttled(
+            channel_identifier, lambda client: get_message_data(client, peer, message_ids)
+        )
+        if messages:
+            self.messages += sum(1 for message in messages if message)
+        return messages, error
+
+    async def throttled(self, channel_identifier, request, stage="fetch"):
+        # Runs request(client) on the channel's account within the concurrency
+        # and rate limits, retrying it after any flood wait it triggers. Only
+        # the request itself is profiled as `stage`, not the wait for a slot.
+        # Flood waits longer than max_flood_wait are not slept through: the
+        # request fails with (None, error) like any other failed request.
+        account = self.account_for(channel_identifier)
+        while True:
+            self.queued += 1
+            async with account.semaphore:
+                self.queued -= 1
+                delay = account.resume_at - time.monotonic()
+                if self.max_flood_wait and delay > self.max_flood_wait:
+                    return None, self.flood_wait_error(delay)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await account.limiter.acquire()
+                await self.channel_limiter(channel_identifier).acquire()
+                self.requests += 1
+                try:
+                    with profile_stage(stage):
+                        return await request(account.client)
+                except FloodWaitError as e:
+                    if self.max_flood_wait and e.seconds > self.max_flood_wait:
+                        # Later requests on this account fail straight away
+                        # instead of running into the same wait.
+                        account.resume_at = max(account.resume_at, time.monotonic() + e.seconds)
+                        self.flood_waits += 1
+                        return None, self.flood_wait_error(e.seconds)
+                    self.record_flood_wait(account, e.seconds)
+
+    def flood_wait_error(self, seconds):
+        return "Telegram asked to wait {:.0f}s (flood wait), more than the {}s limit".format(
+            seconds, self.max_flood_wait
+        )
+
+    @contextlib.contextmanager
+    def active_batch(self):
+        # Telethon normally sleeps through short flood waits itself while holding
+        # the request slot; turn that off so they are requeued and counted here.
+        # Batches may nest (album expansion runs inside a fetch), so only the
+        # outermost one times the run and restores the client settings.
+        if self.active == 0:
+            for account in self.accounts:
+                suspend_flood_sleep(account.client)
+            self.started = time.monotonic()
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            if self.active == 0:
+                self.elapsed += time.monotonic() - self.started
+                for account in self.accounts:
+                    restore_flood_sleep(account.client)
+
+    async def gather(self, coroutines):
+        with self.active_batch():
+            return await asyncio.gather(*coroutines)
+
+    async def run(self, jobs, linked=True):
+        # jobs is a list of (channel_identifier, message_ids); results come back
+        # in the same order as (messages, error) pairs.
+        return await self.gather(
+            [self.fetch(channel_identifier, message_ids, linked) for channel_identifier, message_ids in jobs]
+        )
+
+    async def resolve(self, channel_identifiers):
+        # Resolves each distinct channel to an input peer once, using its
+        # account's entity cache where possible. Returns
+        # {channel_identifier: error} for the channels that could not be
+        # resolved.
+        #
+        # Not every account can see every chat (a private /c/ chat only
+        # resolves for its members), so a channel its own account cannot
+        # resolve is tried on the other accounts in turn, and moves to the
+        # first that succeeds.
+        errors = {}
+        pending = []
+        for channel_identifier in channel_identifiers:
+            if channel_identifier in self.peers:
+                continue
+            for account in self.accounts_to_try(channel_identifier):
+                peer = account.entity_cache.lookup(channel_identifier) if account.entity_cache else None
+                if peer is not None:
+                    self.channel_accounts[channel_identifier] = account
+                    self.peers[channel_identifier] = peer
+                    break
+            else:
+                pending.append(channel_identifier)
+
+        async def resolve_one(channel_identifier):
+            for account in self.accounts_to_try(channel_identifier):
+                self.channel_accounts[channel_identifier] = account
+                peer, error = await self.throttled(
+                    channel_identifier, lambda client: resolve_entity(client, channel_identifier), "resolve"
+                )
+                if not error:
+                    break
+            if error:
+                errors[channel_identifier] = error
+                return
+            self.peers[channel_identifier] = peer
+            if account.entity_cache:
+                account.entity_cache.store(channel_identifier, peer)
+
+        await self.gather([resolve_one(channel_identifier) for channel_identifier in pending])
+        return errors
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "messages": self.messages,
+            "elapsed": self.elapsed,
+            "rate": self.messages / self.elapsed if self.elapsed else 0.0,
+            "flood_waits": self.flood_waits,
+            "flood_seconds": self.flood_wait_seconds,
+            "accounts": len(self.accounts),
+        }
+
+def flatten_message(message, display_channel):
+    with profile_stage("flatten"):
+        reactions_str = ""
+        if message.reactions and hasattr(message.reactions, 'results') and message.reactions.results:
+            reactions_list = [
+                f"{reaction.reaction.emoticon}: {reaction.count}"
+                for reaction in message.reactions.results
+                if reaction.reaction and hasattr(reaction.reaction, 'emoticon')
+            ]
+            reactions_str = ", ".join(reactions_list)
+        entities_str = ""
+        if message.entities:
+            entities_str = ", ".join({type(entity).__name__ for entity in message.entities})
+        return {
+            "Channel": display_channel,
+            "Message ID": message.id,
+            "Date": message.date.strftime("%Y-%m-%d %H:%M:%S") if message.date else None,
+            "Edit Date": message.edit_date.strftime("%Y-%m-%d %H:%M:%S") if message.edit_date else None,
+            "Text": message.message,
+            "Media Present": "Yes" if message.media else "No",
+            "Media Type": type(message.media).__name__ if message.media else None,
+            "Views": message.views,
+            "Forwards": message.forwards,
+            "Reactions": reactions_str,
+            "Entities": entities_str,
+            "Pinned": message.pinned,
+            "Silent": message.silent,
+            "Post": message.post,
+            "Forwarded": "Yes" if message.fwd_from else "No",
+            "Via Bot": message.via_bot_id,
+            "Grouped ID": message.grouped_id,
+        }
+
+# -------------------------------------------
+# Album (grouped_id) expansion
+# -------------------------------------------
+# An album holds at most 10 items with consecutive ids, so every sibling of a
+# message lies within this many ids on either side of it.
+ALBUM_MAX_ITEMS = 10
+
+async def fetch_album_members(scheduler, fetched, album_cache):
+    # Returns {(channel_identifier, grouped_id): messages sorted by id} for
+    # every album in `fetched`. album_cache only memoises the ids of each
+    # album's members, so an album seen before is fetched by those ids
+    # (through the message cache and its TTL) instead of by scanning the id
+    # range around the linked message again. The ranges and ids of all albums
+    # in a channel are merged so that they share get_messages chunks.
+    albums = {}
+    for (channel_identifier, message_id), message in fetched.items():
+        if message and message.grouped_id:
+            albums.setdefault((channel_identifier, message.grouped_id), message_id)
+    if not albums:
+        return {}
+    wanted = {}
+    for (channel_identifier, grouped_id), message_id in albums.items():
+        ids = wanted.setdefault(channel_identifier, {})
+        sibling_ids = album_cache.get((channel_identifier, grouped_id)) or range(
+            max(1, message_id - ALBUM_MAX_ITEMS + 1), message_id + ALBUM_MAX_ITEMS
+        )
+        for sibling_id in sibling_ids:
+            if (channel_identifier, sibling_id) not in fetched:
+                ids[sibling_id] = None
+    jobs = []
+    for channel_identifier, ids in wanted.items():
+        jobs.extend((channel_identifier, chunk) for chunk in chunk_ids(sorted(ids)))
+
+    candidates = {key: message for key, message in fetched.items() if message}
+    failed_channels = set()
+    for (channel_identifier, chunk), (messages, error) in zip(jobs, await scheduler.run(jobs, linked=False)):
+        if error:
+            failed_channels.add(channel_identifier)
+            continue
+        for message_id, message in zip(chunk, messages):
+            if message:
+                candidates[(channel_identifier, message_id)] = message
+
+    members = {album_key: [] for album_key in albums if album_key[0] not in failed_channels}
+    for (channel_identifier, message_id), message in candidates.items():
+        album_key = (channel_identifier, message.grouped_id)
+        if album_key in members:
+            members[album_key].append(message)
+    for album_key, messages in members.items():
+        messages.sort(key=lambda message: message.id)
+        album_cache[album_key] = [message.id for message in messages]
+    return members
+
+async def iter_messages(client, links, scheduler=None, expand_albums=False, album_cache=None,
+                        progress=log_progress, on_link=None):
+    # Yields (link, channel_identifier, message, row) in the order of `links`,
+    # as soon as every link before it has been fetched, so callers can write
+    # results out while later chunks are still in flight. on_link(position,
+    # status, error) is called once per link when its outcome is final, after
+    # its rows have been yielded; status is "completed" (including links whose
+    # message does not exist) or "failed".
+    if on_link is None:
+        on_link = lambda position, status, error=None: None
+    if scheduler is None:
+        scheduler = FetchScheduler(client)
+    cache = scheduler.cache
+    # A forced refresh must not trust the album membership memoised earlier.
+    if album_cache is None or (cache and cache.force_refresh):
+        album_cache = {}
+    # Canonicalize and dedupe the links first, then group the message ids by
+    # channel so each channel is fetched with as few get_messages calls as
+    # possible. Every input position still gets its own result.
+    with profile_stage("parse"):
+        entries, entry_positions = normalize_links(links)
+    parsed = []
+    for position, (link, index) in enumerate(zip(links, entry_positions)):
+        if index is None:
+            progress("warning", "link_not_recognised", link=link)
+            on_link(position, "failed", "link not recognised")
+            continue
+        canonical_link, channel_identifier, message_id = entries[index]
+        parsed.append((position, link, channel_identifier, message_id))
+    batches = {}
+    for canonical_link, channel_identifier, message_id in entries:
+        batches.setdefault(channel_identifier, []).append(message_id)
+
+    # Resolve every distinct channel once; an unresolvable channel is reported
+    # a single time and its links are skipped.
+    resolve_errors = await scheduler.resolve(list(batches))
+    for channel_identifier, error in resolve_errors.items():
+        progress(
+            "error", "unresolved_channel",
+            channel=display_channel_name(channel_identifier),
+            count=sum(1 for entry in parsed if entry[2] == channel_identifier),
+            error=error,
+        )
+        del batches[channel_identifier]
+    for position, link, channel_identifier, message_id in parsed:
+        if channel_identifier in resolve_errors:
+            on_link(position, "failed", resolve_errors[channel_identifier])
+    parsed = [entry for entry in parsed if entry[2] not in resolve_errors]
+
+    jobs = []
+    for channel_identifier, message_ids in batches.items():
+        progress("info", "processing_batch", channel=display_channel_name(channel_identifier), count=len(message_ids))
+        jobs.extend((channel_identifier, chunk) for chunk in chunk_ids(message_ids))
+    # Start the chunks in the order the links need them, so rows are emitted
+    # (and their messages freed) while later chunks are still in flight,
+    # rather than only once most channels have been fetched in full. Each
+    # chunk's first id is the one its earliest link points at.
+    first_needed = {}
+    for position, link, channel_identifier, message_id in parsed:
+        first_needed.setdefault((channel_identifier, message_id), position)
+    jobs.sort(key=lambda job: first_needed[(job[0], job[1][0])])
+
+    async def fetch_job(channel_identifier, chunk):
+        messages, error = await scheduler.fetch(channel_identifier, chunk)
+        albums = {}
+        if messages and expand_albums:
+            albums = await fetch_album_members(
+                scheduler, {(channel_identifier, message_id): message for message_id, message in zip(chunk, messages)},
+                album_cache,
+            )
+        return channel_identifier, chunk, messages, error, albums
+
+    # Fetched messages (and errors) wait here until every link to them has
+    # been emitted, then are dropped, so only the messages still needed stay
+    # in memory. remaining counts the links yet to be emitted per message.
+    fetched = {}
+    errors = {}
+    remaining = {}
+    for position, link, channel_identifier, message_id in parsed:
+        key = (channel_identifier, message_id)
+        remaining[key] = remaining.get(key, 0) + 1
+    # The album members of each fetched message that is part of an album.
+    album_siblings = {}
+    next_link = 0
+    # Album siblings follow the linked message, each emitted once per run.
+    emitted = set()
+    # Each fetch task hands itself to `finished` when done and is dropped once
+    # its result has been consumed below, so a chunk's messages are freed as
+    # soon as no link still needs them.
+    tasks = set()
+    finished = asyncio.Queue()
+
+    def task_done(task):
+        tasks.discard(task)
+        finished.put_nowait(task)
+
+    def start_fetch(channel_identifier, chunk):
+        task = asyncio.ensure_future(fetch_job(channel_identifier, chunk))
+        task.add_done_callback(task_done)
+        tasks.add(task)
+
+    with scheduler.active_batch():
+        try:
+            for channel_identifier, chunk in jobs:
+                start_fetch(channel_identifier, chunk)
+            for _ in range(len(jobs)):
+                channel_identifier, chunk, messages, error, albums = (await finished.get()).result()
+                for index, message_id in enumerate(chunk):
+                    key = (channel_identifier, message_id)
+                    if error:
+                        errors[key] = error
+                        continue
+                    message = messages[index]
+                    fetched[key] = message
+                    if message and message.grouped_id and (channel_identifier, message.grouped_id) in albums:
+                        album_siblings[key] = albums[(channel_identifier, message.grouped_id)]
+                # Release the chunk itself; the messages live on in `fetched`.
+                messages = albums = None
+
+                # Emit every link whose message is now known, in link order.
+                while next_link < len(parsed):
+                    position, link, channel_identifier, message_id = parsed[next_link]
+                    key = (channel_identifier, message_id)
+                    if key not in fetched and key not in errors:
+                        break
+                    next_link += 1
+                    remaining[key] -= 1
+                    if remaining[key]:
+                        error, message, siblings = errors.get(key), fetched.get(key), album_siblings.get(key, ())
+                    else:
+                        del remaining[key]
+                        error, message, siblings = errors.pop(key, None), fetched.pop(key, None), album_siblings.pop(key, ())
+                    if error:
+                        progress("error", "fetch_error", link=link, error=error)
+                        on_link(position, "failed", error)
+                        continue
+                    if not message:
+                        progress("warning", "no_message_found", link=link)
+                        on_link(position, "completed")
+                        continue
+                    display_channel = display_channel_name(channel_identifier)
+                    yield link, channel_identifier, message, (
+                        cache.row(channel_identifier, message) if cache else flatten_message(message, display_channel)
+                    )
+                    emitted.add(key)
+                    for sibling in siblings:
+                        sibling_key = (channel_identifier, sibling.id)
+                        if sibling_key not in emitted:
+                            yield link, channel_identifier, sibling, (
+                                cache.row(channel_identifier, sibling) if cache else flatten_message(sibling, display_channel)
+                            )
+                            emitted.add(sibling_key)
+                    on_link(position, "completed")
+        finally:
+            for task in list(tasks):
+                task.cancel()
+
+async def process_messages(client, links, scheduler=None, expand_albums=False, album_cache=None, progress=log_progress):
+    # Collects everything iter_messages yields; fine for small link lists,
+    # use export_messages to stream large ones to disk instead.
+    results = []
+    raw_messages = []
+    async for link, channel_identifier, message, row in iter_messages(
+        client, links, scheduler, expand_albums, album_cache, progress
+    ):
+        results.append(row)
+        raw_messages.append((link, message))
+    return results, raw_messages
+
+# -------------------------------------------
+# Async function to download all media from raw messages.
+# -------------------------------------------
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+
+# Formats that are already compressed gain nothing from deflate, so they are
+# stored as-is in the ZIP.
+COMPRESSED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".tgs",
+    ".mp4", ".mov", ".mkv", ".webm", ".avi",
+    ".mp3", ".m4a", ".ogg", ".oga", ".opus", ".aac", ".flac",
+    ".zip", ".rar", ".7z", ".gz", ".bz2", ".xz", ".pdf", ".docx", ".xlsx", ".pptx",
+}
+
+def zip_compression_for(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    return zipfile.ZIP_STORED if extension in COMPRESSED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+# Downloaded media is kept in a content-addressed store: files are named by
+# their SHA-256 under objects/, and an index maps each Telegram photo or
+# document (id and access hash) to its file, so media already pulled once is
+# never downloaded again and identical files are only stored once.
+MEDIA_STORE_DIR = "media_store"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def media_key(media):
+    # Returns a key identifying the file behind a message's media, or None for
+    # media without a stable file identity (contacts, polls, locations, ...).
+    if isinstance(media, types.MessageMediaWebPage):
+        webpage = media.webpage
+        media = (webpage.document or webpage.photo) if isinstance(webpage, types.WebPage) else None
+    else:
+        media = getattr(media, "photo", None) or getattr(media, "document", None)
+    if isinstance(media, types.Photo):
+        return "photo-{}-{}".format(media.id, media.access_hash)
+    if isinstance(media, types.Document):
+        return "document-{}-{}".format(media.id, media.access_hash)
+    return None
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class MediaStore:
+    def __init__(self, root=MEDIA_STORE_DIR):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        # Downloads land in tmp/ first so they can be moved into objects/
+        # without crossing file systems.
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS media ("
+                "key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, path TEXT NOT NULL, "
+                "name TEXT NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL)"
+            )
+
+    def lookup(self, key):
+        # Returns the stored entry for key, or None if it was never stored or
+        # its file has since been removed.
+        row = self.conn.execute(
+            "SELECT sha256, path, name, size FROM media WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.root, row[1])):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"sha256": row[0], "path": row[1], "name": row[2], "size": row[3]}
+
+    def add_file(self, file_path):
+        # Hashes file_path and moves it into objects/, returning its entry.
+        # Only touches the file system, so it can run in a worker thread.
+        sha256 = file_sha256(file_path)
+        name = os.path.basename(file_path)
+        path = os.path.join("objects", sha256[:2], sha256 + os.path.splitext(name)[1].lower())
+        target = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(file_path)
+        else:
+            os.replace(file_path, target)
+        return {"sha256": sha256, "path": path, "name": name, "size": os.path.getsize(target)}
+
+    def remember(self, key, entry):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)",
+                (key, entry["sha256"], entry["path"], entry["name"], entry["size"], time.time()),
+            )
+
+    def file_path(self, entry):
+        return os.path.join(self.root, entry["path"])
+
+    def close(self):
+        self.conn.close()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+def peak_memory_megabytes():
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS; the resource
+    # module does not exist on Windows.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+async def download_all_media(client, raw_messages, zip_path, concurrency=DEFAULT_DOWNLOAD_CONCURRENCY,
+                             store=None, progress=log_progress):
+    # Media not yet in the store is downloaded concurrently, and every file is
+    # streamed from the store into the ZIP at zip_path, so neither the archive
+    # nor the media is ever held in memory as a whole. Each distinct file is
+    # added to the ZIP once, named by its hash, and manifest.json in the ZIP
+    # maps every link to its file (or to the error that stopped its download).
+    # peak_megabytes is the process's peak resident memory so far (None where
+    # the platform cannot tell), which costs nothing to read, unlike tracing.
+    stats = {"files": 0, "bytes": 0, "downloaded": 0, "reused": 0, "errors": 0}
+    own_store = store is None
+    if own_store:
+        store = MediaStore()
+    start = time.monotonic()
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+    # ZipFile is not safe for concurrent writes, so entries are added one at a time.
+    zip_lock = asyncio.Lock()
+    archived = {}
+
+    async def obtain(key, message):
+        entry = store.lookup(key) if key else None
+        if entry is None:
+            async with semaphore:
+                # Each download gets its own directory so concurrent downloads
+                # never race on Telethon's choice of file name.
+                target_dir = tempfile.mkdtemp(dir=store.tmp_dir)
+                try:
+                    with profile_stage("download"):
+                        file_path = await client.download_media(message.media, file=target_dir)
+                    if not file_path:
+                        return None
+                    # Hashing large files would block the event loop and stall
+                    # the other downloads, so it runs in a worker thread.
+                    entry = await loop.run_in_executor(None, store.add_file, file_path)
+                finally:
+                    shutil.rmtree(target_dir, ignore_errors=True)
+            if key:
+                store.remember(key, entry)
+            stats["downloaded"] += 1
+        else:
+            stats["reused"] += 1
+        async with zip_lock:
+            if entry["sha256"] not in archived:
+                arcname = entry["sha256"] + os.path.splitext(entry["name"])[1].lower()
+                source = store.file_path(entry)
+                with profile_stage("zip"):
+                    await loop.run_in_executor(
+                        None,
+                        lambda: zipf.write(source, arcname=arcname, compress_type=zip_compression_for(source))
+                    )
+                archived[entry["sha256"]] = arcname
+                stats["bytes"] += entry["size"]
+        return entry
+
+    async def obtain_or_error(key, link, message):
+        try:
+            return await obtain(key, message)
+        except Exception as e:
+            stats["errors"] += 1
+            progress("warning", "media_error", link=link, error=e)
+            return {"error": str(e)}
+
+    try:
+        with zipfile.ZipFile(zip_path, "w") as zipf:
+            # Messages pointing at the same photo or document (forwards of one
+            # post, say) share a single download.
+            items = []
+            pending = {}
+            for index, (link, message) in enumerate(raw_messages):
+                if not message.media:
+                    continue
+                key = media_key(message.media)
+                slot = key or index
+                if slot not in pending:
+                    pending[slot] = obtain_or_error(key, link, message)
+                items.append((link, key, slot))
+            entries = dict(zip(pending, await asyncio.gather(*pending.values())))
+
+            manifest = []
+            for link, key, slot in items:
+                entry = entries[slot]
+                if entry is None:
+                    continue
+                if "error" in entry:
+                    manifest.append({"link": link, "media_key": key, "error": entry["error"]})
+                    continue
+                manifest.append({
+                    "link": link,
+                    "media_key": key,
+                    "file": archived[entry["sha256"]],
+                    "sha256": entry["sha256"],
+                    "size": entry["size"],
+                    "original_name": entry["name"],
+                })
+            stats["files"] = len(archived)
+            zipf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    finally:
+        elapsed = time.monotonic() - start
+        if own_store:
+            store.close()
+    megabytes = stats["bytes"] / (1024 * 1024)
+    stats.update({
+        "megabytes": megabytes,
+        "elapsed": elapsed,
+        "rate": megabytes / elapsed if elapsed else 0.0,
+        "peak_megabytes": peak_memory_megabytes(),
+    })
+    return stats
+
+# -------------------------------------------
+# Link input and result output
+# -------------------------------------------
+LINK_SEPARATOR = re.compile(r"[\s,]+")
+
+def split_links(text):
+    # The separator already consumes all whitespace, so only empty strings
+    # (from leading or trailing separators) need dropping.
+    return [link for link in LINK_SEPARATOR.split(text) if link]
+
+def read_links(stream):
+    # Links may be separated by spaces, commas or new lines, as in the UI.
+    links = []
+    for line in stream:
+        links.extend(split_links(line))
+    return links
+
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet")
+
+def output_format_for(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    return extension if extension in OUTPUT_FORMATS else "csv"
+
+class ResultWriter:
+    # Appends rows to a CSV or JSONL file as they arrive. Parquet cannot be
+    # appended to, so rows are spooled to a JSONL file and converted on close.
+    def __init__(self, path, output_format=None):
+        self.path = path
+        self.output_format = output_format or output_format_for(path)
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {self.output_format}")
+        self.rows = 0
+        self.csv_writer = None
+        if self.output_format == "csv":
+            self.file = open(path, "w", newline="", encoding="utf-8")
+        elif self.output_format == "jsonl":
+            self.file = open(path, "w", encoding="utf-8")
+        else:
+            self.file = tempfile.NamedTemporaryFile("w+", suffix=".jsonl", encoding="utf-8")
+
+    def write(self, row):
+        if self.output_format == "csv":
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(self.file, fieldnames=list(row))
+                self.csv_writer.writeheader()
+            self.csv_writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        self.rows += 1
+
+    def close(self):
+        if self.output_format == "parquet":
+            # pyarrow is only needed for this format. Column types follow the
+            # JSON values as written, so "00123" stays a string and an integer
+            # column with gaps stays a nullable int64 rather than float.
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.file.flush()
+            self.file.seek(0)
+            pq.write_table(pa.Table.from_pylist([json.loads(line) for line in self.file]), self.path)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_results(results, path, output_format=None):
+    with ResultWriter(path, output_format) as writer:
+        for row in results:
+            writer.write(row)
+
+# -------------------------------------------
+# Canonical raw message export
+# -------------------------------------------
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def canonical_message_json(message):
+    # message.to_dict() as deterministic JSON: sorted keys, no insignificant
+    # whitespace, ISO 8601 dates and base64 bytes, so the same message always
+    # serializes to the same bytes and can be checked against its hash.
+    return json.dumps(
+        message.to_dict(), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=json_default
+    )
+
+def content_hash(canonical_json):
+    return hashlib.sha256(canonical_json.encode("utf-8")).hexdigest()
+
+class MessageRecord:
+    # The slim per-message record kept in memory for a run, in place of the
+    # Telethon Message; load_messages brings the message back when needed.
+    __slots__ = ("link", "channel_identifier", "message_id", "has_media", "sha256")
+
+    def __init__(self, link, channel_identifier, message_id, has_media, sha256):
+        self.link = link
+        self.channel_identifier = channel_identifier
+        self.message_id = message_id
+        self.has_media = has_media
+        self.sha256 = sha256
+
+    def to_list(self):
+        return [self.link, self.channel_identifier, self.message_id, self.has_media, self.sha256]
+
+RAW_FORMATS = ("jsonl", "msgpack")
+
+class RawWriter:
+    # Writes one {"link", "message", "sha256"} record per message. In JSONL the
+    # canonical message JSON is embedded verbatim, so the bytes between
+    # "message": and ,"sha256" hash to the recorded value. msgpack (optional
+    # dependency) stores the same record with the message as a map.
+    def __init__(self, path, raw_format=None):
+        self.raw_format = raw_format or ("msgpack" if path.lower().endswith(".msgpack") else "jsonl")
+        if self.raw_format not in RAW_FORMATS:
+            raise ValueError(f"Unsupported raw format: {self.raw_format}")
+        if self.raw_format == "msgpack":
+            import msgpack
+            self.packer = msgpack.Packer()
+            self.file = open(path, "wb")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, link, canonical_json, sha256):
+        if self.raw_format == "msgpack":
+            # json.loads keeps the sorted key order, so packing is deterministic too.
+            self.file.write(self.packer.pack({"link": link, "message": json.loads(canonical_json), "sha256": sha256}))
+        else:
+            self.file.write(
+                '{"link":' + json.dumps(link, ensure_ascii=False)
+                + ',"message":' + canonical_json
+                + ',"sha256":"' + sha256 + '"}\n'
+            )
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_raw_record(path, index):
+    # Returns the JSONL line of the index-th record in a raw export.
+    with open(path, encoding="utf-8") as f:
+        return next(itertools.islice(f, index, None))
+
+async def export_messages(client, links, path, output_format=None, raw_path=None, on_row=None, **kwargs):
+    # Streams the rows for `links` into `path`, and the canonical raw messages
+    # into raw_path if given, and returns a MessageRecord per row instead of
+    # the messages; load_messages brings them back from the message cache.
+    records = []
+    with ResultWriter(path, output_format) as writer, \
+            (RawWriter(raw_path) if raw_path else contextlib.nullcontext()) as raw_writer:
+        async for link, channel_identifier, message, row in iter_messages(client, links, **kwargs):
+            with profile_stage("export"):
+                canonical_json = canonical_message_json(message)
+                sha256 = content_hash(canonical_json)
+                writer.write(row)
+                if raw_writer:
+                    raw_writer.write(link, canonical_json, sha256)
+            records.append(MessageRecord(link, channel_identifier, message.id, bool(message.media), sha256))
+            if on_row:
+                on_row(len(records))
+    return records
+
+async def load_messages(scheduler, records, media_only=False, progress=log_progress):
+    # Returns (link, message) pairs for records from export_messages. Messages
+    # still fresh in the scheduler's cache are read from it; the rest (evicted,
+    # past the TTL and so possibly holding expired file references, or never
+    # cached) are fetched again through the scheduler. Every link whose message
+    # cannot be loaded, or with media_only no longer has media, is reported.
+    cache = scheduler.cache
+    wanted = [record for record in records if record.has_media or not media_only]
+    by_channel = {}
+    for record in wanted:
+        by_channel.setdefault(record.channel_identifier, set()).add(record.message_id)
+    loaded = {}
+    jobs = []
+    for channel_identifier, message_ids in by_channel.items():
+        for chunk in chunk_ids(sorted(message_ids)):
+            found = cache.load(scheduler.client, channel_identifier, chunk) if cache else {}
+            for message_id, message in found.items():
+                loaded[(channel_identifier, message_id)] = message
+            missing = [message_id for message_id in chunk if message_id not in found]
+            if missing:
+                jobs.append((channel_identifier, missing))
+
+    errors = await scheduler.resolve({channel_identifier for channel_identifier, _ in jobs})
+    jobs = [job for job in jobs if job[0] not in errors]
+    for (channel_identifier, message_ids), (messages, error) in zip(jobs, await scheduler.run(jobs, linked=False)):
+        for index, message_id in enumerate(message_ids):
+            if error:
+                errors[(channel_identifier, message_id)] = error
+            elif messages[index]:
+                loaded[(channel_identifier, message_id)] = messages[index]
+
+    pairs = []
+    for record in wanted:
+        key = (record.channel_identifier, record.message_id)
+        message = loaded.get(key)
+        if message is None:
+            error = errors.get(key) or errors.get(record.channel_identifier) or "message no longer exists"
+        elif media_only and not message.media:
+            error = "message no longer has media"
+        else:
+            pairs.append((record.link, message))
+            continue
+        progress("warning", "media_not_loaded" if media_only else "fetch_error", link=record.link, error=error)
+    return pairs
+
+# -------------------------------------------
+# Resumable jobs
+# -------------------------------------------
+JOBS_DIR = "jobs"
+# The manifest is rewritten after this many links have finished.
+CHECKPOINT_INTERVAL = 500
+
+class Job:
+    # A job keeps its links, a checkpoint manifest of per-link status and the
+    # partial output in jobs/<job_id>/, so an interrupted run can be resumed
+    # and only the failed or pending links are fetched again.
+    #
+    # parts.jsonl is append-only: every finished link appends its rows tagged
+    # with the link position and the attempt (run) number. The manifest records
+    # which attempt completed each link, so rows left behind by an attempt that
+    # died before its checkpoint are ignored when the output is assembled.
+    def __init__(self, job_dir, manifest):
+        self.job_dir = job_dir
+        self.manifest = manifest
+
+    @property
+    def job_id(self):
+        return self.manifest["job_id"]
+
+    @property
+    def links(self):
+        return self.manifest["links"]
+
+    @classmethod
+    def create(cls, links, jobs_dir=JOBS_DIR, options=None):
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        job_dir = os.path.join(jobs_dir, job_id)
+        os.makedirs(job_dir)
+        job = cls(job_dir, {
+            "job_id": job_id,
+            "created_at": time.time(),
+            "options": options or {},
+            "links": list(links),
+            "status": ["pending"] * len(links),
+            "completed_attempt": [None] * len(links),
+            "errors": {},
+            "attempts": 0,
+        })
+        job.save()
+        return job
+
+    @classmethod
+    def load(cls, job_id, jobs_dir=JOBS_DIR):
+        job_dir = os.path.join(jobs_dir, job_id)
+        with open(os.path.join(job_dir, "manifest.json"), encoding="utf-8") as f:
+            return cls(job_dir, json.load(f))
+
+    @property
+    def parts_path(self):
+        return os.path.join(self.job_dir, "parts.jsonl")
+
+    def save(self):
+        # Write to a temporary file and rename it, so a crash never leaves a
+        # half-written manifest behind.
+        path = os.path.join(self.job_dir, "manifest.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def pending_positions(self):
+        return [position for position, status in enumerate(self.manifest["status"]) if status != "completed"]
+
+    def summary(self):
+        statuses = self.manifest["status"]
+        return {
+            "job_id": self.job_id,
+            "completed": statuses.count("completed"),
+            "failed": statuses.count("failed"),
+            "pending": statuses.count("pending"),
+        }
+
+    async def run(self, client, scheduler=None, album_cache=None, progress=log_progress):
+        # Fetches every link that is not yet completed and checkpoints as it goes.
+        positions = self.pending_positions()
+        self.manifest["attempts"] += 1
+        attempt = self.manifest["attempts"]
+        # The attempt number is saved before any of its rows are written, so
+        # a run killed before its first checkpoint is never taken for it.
+        self.save()
+        manifest = self.manifest
+        buffered = []
+        finished = 0
+
+        def on_link(index, status, error=None):
+            nonlocal finished
+            position = positions[index]
+            if status == "completed":
+                # A link's own message comes first; any rows after it are album
+                # siblings, which finalize emits only once across attempts.
+                for row_index, part in enumerate(buffered):
+                    part["position"] = position
+                    part["sibling"] = row_index > 0
+                    parts.write(json.dumps(part, ensure_ascii=False, default=str) + "\n")
+                manifest["completed_attempt"][position] = attempt
+                manifest["errors"].pop(str(position), None)
+            else:
+                manifest["errors"][str(position)] = error
+            buffered.clear()
+            manifest["status"][position] = status
+            finished += 1
+            if finished % CHECKPOINT_INTERVAL == 0:
+                # Rows must be on disk before the manifest says they are.
+                parts.flush()
+                os.fsync(parts.fileno())
+                self.save()
+
+        with open(self.parts_path, "a", encoding="utf-8") as parts:
+            try:
+                async for link, channel_identifier, message, row in iter_messages(
+                    client, [self.links[position] for position in positions], scheduler,
+                    self.manifest["options"].get("expand_albums", False), album_cache, progress, on_link,
+                ):
+                    # Rows are held until their link is complete, since the
+                    # position is only known then.
+                    canonical_json = canonical_message_json(message)
+                    sha256 = content_hash(canonical_json)
+                    buffered.append({
+                        "attempt": attempt,
+                        "record": MessageRecord(link, channel_identifier, message.id, bool(message.media), sha256).to_list(),
+                        "row": row,
+                        "raw": canonical_json,
+                    })
+            finally:
+                parts.flush()
+                os.fsync(parts.fileno())
+                self.save()
+        return self.summary()
+
+    def finalize(self, output_path, raw_path=None, output_format=None):
+        # Assembles the output in link order from the rows of the attempts that
+        # completed each link, exactly as an uninterrupted run would have
+        # written it. Returns the MessageRecords for load_messages.
+        #
+        # Each attempt only dedupes album siblings against its own links, so a
+        # sibling already written for an earlier link (possibly by another
+        # attempt) is skipped here, as iter_messages does within one run.
+        completed_attempt = self.manifest["completed_attempt"]
+        offsets = []
+        with open(self.parts_path, "ab+") as parts:
+            parts.seek(0)
+            offset = 0
+            for sequence, line in enumerate(parts):
+                part = json.loads(line)
+                if completed_attempt[part["position"]] == part["attempt"]:
+                    offsets.append((part["position"], sequence, offset))
+                offset += len(line)
+        offsets.sort()
+        records = []
+        written = set()
+        with ResultWriter(output_path, output_format) as writer, \
+                (RawWriter(raw_path) if raw_path else contextlib.nullcontext()) as raw_writer, \
+                open(self.parts_path, "rb") as parts:
+            for position, sequence, offset in offsets:
+                parts.seek(offset)
+                part = json.loads(parts.readline())
+                record = MessageRecord(*part["record"])
+                key = (channel_key(record.channel_identifier), record.message_id)
+                if part.get("sibling") and key in written:
+                    continue
+                written.add(key)
+                writer.write(part["row"])
+                if raw_writer:
+                    raw_writer.write(record.link, part["raw"], record.sha256)
+                records.append(record)
+        return records
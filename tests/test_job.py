@@ -0,0 +1,64 @@
+import asyncio
+import csv
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import scraper  # noqa: E402
+from fake_telegram import FakeTelegramClient  # noqa: E402
+from scraper import FetchScheduler, Job, MessageCache  # noqa: E402
+
+class Crash(BaseException):
+    # Stands in for the process being killed: nothing after it reaches disk.
+    pass
+
+class CrashingClient(FakeTelegramClient):
+    def __init__(self, crash_on_request, **kwargs):
+        super().__init__(**kwargs)
+        self.crash_on_request = crash_on_request
+        self.crashed = False
+
+    async def get_messages(self, peer, ids):
+        if self.requests + 1 >= self.crash_on_request:
+            self.crashed = True
+            raise Crash()
+        return await super().get_messages(peer, ids)
+
+def run_job(job, client, cache_path):
+    scheduler = FetchScheduler(client, 1, 0, 0, cache=MessageCache(cache_path, ttl=0))
+    try:
+        return asyncio.run(job.run(client, scheduler, progress=lambda *args, **details: None))
+    finally:
+        scheduler.cache.close()
+
+def test_resume_after_crash_before_first_checkpoint(tmp_path, monkeypatch):
+    links = [f"https://t.me/chan{channel}/{message_id}" for channel in range(4) for message_id in range(1, 51)]
+    # The crash has to come before the first checkpoint.
+    assert len(links) < scraper.CHECKPOINT_INTERVAL
+    job = Job.create(links, jobs_dir=str(tmp_path / "jobs"))
+
+    # Manifest saves made while the crash unwinds would never happen after a
+    # real kill, so they are dropped.
+    client = CrashingClient(crash_on_request=7, latency=0)
+    save = Job.save
+    monkeypatch.setattr(Job, "save", lambda self: None if client.crashed else save(self))
+    try:
+        run_job(job, client, str(tmp_path / "cache.sqlite"))
+    except Crash:
+        pass
+    assert client.crashed
+    monkeypatch.setattr(Job, "save", save)
+
+    resumed = Job.load(job.job_id, jobs_dir=str(tmp_path / "jobs"))
+    summary = run_job(resumed, FakeTelegramClient(latency=0), str(tmp_path / "cache.sqlite"))
+    assert summary["completed"] == len(links)
+
+    output_path = str(tmp_path / "out.csv")
+    records = resumed.finalize(output_path)
+    with open(output_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert [record.link for record in records] == links
+    assert len(rows) == len(links)
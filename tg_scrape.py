@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""Headless bulk link processing without Streamlit.
+
+Reads Telegram post links from a file (or stdin) and writes the same table
+the web app shows as CSV, JSONL or Parquet:
+
+    python tg_scrape.py links.txt -o messages.csv --api-id 123 --api-hash abc --phone +441234567890
+
+Credentials may also be given as TG_API_ID, TG_API_HASH and TG_PHONE. The
+session file is shared with the web app, so an account signed in there can
+be used from cron without prompting.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from scraper import (
+    DEFAULT_CACHE_TTL,
+    DEFAULT_CHANNEL_RATE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_DOWNLOAD_CONCURRENCY,
+    DEFAULT_GLOBAL_RATE,
+    DEFAULT_MAX_FLOOD_WAIT,
+    MEDIA_STORE_DIR,
+    OUTPUT_FORMATS,
+    EntityCache,
+    FetchScheduler,
+    Job,
+    MediaStore,
+    MessageCache,
+    async_get_telegram_client,
+    download_all_media,
+    export_messages,
+    load_messages,
+    read_links,
+)
+
+logger = logging.getLogger("tg_scrape")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Retrieve data for Telegram post links without the web UI.")
+    parser.add_argument("links", nargs="?", default="-", help="File with links, or - for stdin (default)")
+    parser.add_argument("-o", "--output", required=True, help="Output file for the message table")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, help="Output format (default: from the file extension, else csv)")
+    parser.add_argument("--api-id", type=int, default=os.environ.get("TG_API_ID"))
+    parser.add_argument("--api-hash", default=os.environ.get("TG_API_HASH"))
+    parser.add_argument("--phone", default=os.environ.get("TG_PHONE"))
+    parser.add_argument("--extra-phone", action="append", default=[], help="Also spread requests across this already signed-in account (repeatable)")
+    parser.add_argument("--expand-albums", action="store_true", help="Include all items of linked albums")
+    parser.add_argument("--media", help="Also download all media into this ZIP file")
+    parser.add_argument("--media-store", default=MEDIA_STORE_DIR, help="Directory of already downloaded media, reused across runs (default: %(default)s)")
+    parser.add_argument("--job", action="store_true", help="Run as a resumable job, checkpointed under jobs/")
+    parser.add_argument("--resume", metavar="JOB_ID", help="Resume a job, retrying only its failed or pending links")
+    parser.add_argument("--raw", help="Also write the raw messages as canonical JSON with SHA-256 hashes (.jsonl, or .msgpack if msgpack is installed)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--global-rate", type=float, default=DEFAULT_GLOBAL_RATE)
+    parser.add_argument("--channel-rate", type=float, default=DEFAULT_CHANNEL_RATE)
+    parser.add_argument("--max-flood-wait", type=int, default=DEFAULT_MAX_FLOOD_WAIT, help="Fail links hit by flood waits longer than this many seconds instead of waiting (0 = always wait)")
+    parser.add_argument("--download-concurrency", type=int, default=DEFAULT_DOWNLOAD_CONCURRENCY)
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL, help="Seconds before cached messages are refetched (0 = never)")
+    parser.add_argument("--force-refresh", action="store_true", help="Ignore the message cache")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if not args.api_id or not args.api_hash or not args.phone:
+        parser.error("API ID, API hash and phone number are required (arguments or TG_* environment variables)")
+    return args
+
+async def run(args, links):
+    client = await async_get_telegram_client(args.api_id, args.api_hash, args.phone)
+    # Prompts for a code on the terminal if the session is not yet authorised.
+    await client.start(phone=args.phone)
+    cache = MessageCache(ttl=args.cache_ttl, force_refresh=args.force_refresh)
+    entity_cache = EntityCache(args.phone)
+    extra_accounts = []
+    for phone in args.extra_phone:
+        extra_client = await async_get_telegram_client(args.api_id, args.api_hash, phone)
+        if not await extra_client.is_user_authorized():
+            logger.warning("Skipping %s: not signed in", phone)
+            await extra_client.disconnect()
+            continue
+        extra_accounts.append((extra_client, EntityCache(phone)))
+    scheduler = FetchScheduler(
+        client, args.concurrency, args.global_rate, args.channel_rate,
+        cache=cache, entity_cache=entity_cache, extra_accounts=extra_accounts,
+        max_flood_wait=args.max_flood_wait,
+    )
+    try:
+        if args.resume or args.job:
+            job = Job.load(args.resume) if args.resume else Job.create(links, options={"expand_albums": args.expand_albums})
+            logger.info("Job %s: %d link(s) to fetch", job.job_id, len(job.pending_positions()))
+            summary = await job.run(client, scheduler)
+            logger.info("Job %(job_id)s: %(completed)d completed, %(failed)d failed, %(pending)d pending", summary)
+            records = job.finalize(args.output, args.raw, args.format)
+        else:
+            records = await export_messages(
+                client, links, args.output, args.format, args.raw,
+                scheduler=scheduler, expand_albums=args.expand_albums,
+            )
+        logger.info("Wrote %d row(s) to %s", len(records), args.output)
+        logger.info("Fetch: %s", scheduler.stats())
+        logger.info("Message cache: %s", cache.stats())
+        if args.media:
+            raw_messages = await load_messages(scheduler, records, media_only=True)
+            store = MediaStore(args.media_store)
+            try:
+                media_stats = await download_all_media(client, raw_messages, args.media, args.download_concurrency, store)
+            finally:
+                store.close()
+            logger.info("Media: %s", media_stats)
+    finally:
+        cache.close()
+        entity_cache.close()
+        for extra_client, extra_entity_cache in extra_accounts:
+            extra_entity_cache.close()
+            await extra_client.disconnect()
+        await client.disconnect()
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    if args.resume:
+        links = None
+    elif args.links == "-":
+        links = read_links(sys.stdin)
+    else:
+        with open(args.links, encoding="utf-8") as f:
+            links = read_links(f)
+    asyncio.run(run(args, links))
+
+if __name__ == "__main__":
+    main()